@@ -0,0 +1,45 @@
+# Measures how long a fresh worker takes to import the app and build it with main.create_app()
+# Every run is a new interpreter, as a freshly forked or spawned worker would be. Also reports the threads alive
+# after create_app(), which should stay at 1 since the pools and connections are only created by the lifespan.
+# Run from the repository root with `python -m benchmarks.cold_start [runs] [tree ...]`, where the trees are checkouts
+# of other revisions to compare with (e.g. made with `git worktree add`). Trees without create_app() build the app on import.
+import json
+import statistics
+import subprocess
+import sys
+
+
+
+DEFAULT_RUNS = 10
+
+PROBE = """
+import json, threading, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+if "create_app" in vars(main):
+    main.create_app()
+built = time.perf_counter()
+print(json.dumps({"import": imported - start, "create_app": built - imported, "threads": threading.active_count()}))
+"""
+
+
+def run_probe(tree):
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=tree, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(runs, trees):
+    print(f"{'tree':<24} {'phase':<12} {'min (ms)':>10} {'median (ms)':>12} {'max (ms)':>10} {'threads':>8}")
+    for tree in trees:
+        results = [run_probe(tree) for _ in range(runs)]
+        for result in results:
+            result["total"] = result["import"] + result["create_app"]
+        threads = max(result["threads"] for result in results)
+        for phase in ("import", "create_app", "total"):
+            values = [result[phase] * 1000 for result in results]
+            print(f"{tree[-24:]:<24} {phase:<12} {min(values):>10.1f} {statistics.median(values):>12.1f} {max(values):>10.1f} {threads:>8}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RUNS, sys.argv[2:] or ["."])
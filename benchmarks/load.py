@@ -0,0 +1,307 @@
+# Load benchmark for the API hot paths, runs without any external service
+# An ephemeral mongod is started in a temporary directory (or --mongo-url is used with a throw-away database),
+# seeded with users and assets, and the app is served by uvicorn in a subprocess and driven over HTTP with httpx.
+# Run from the repository root with `python -m benchmarks.load --help`, requires the `mongod` binary (or --mongo-url) and httpx.
+from pymongo import MongoClient
+from bson import ObjectId
+from utils.auth import get_hashed_password
+import argparse
+import asyncio
+import datetime
+import httpx
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), "results")
+PASSWORD = "benchmark-password"
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(check, timeout, what):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {what}")
+
+
+# Starts a mongod on a free port with its data in a temporary directory, returns the process, its url and the directory
+def start_mongod(binary):
+    data_directory = tempfile.mkdtemp(prefix="bench-mongod-")
+    port = get_free_port()
+    process = subprocess.Popen(
+        [binary, "--dbpath", data_directory, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"mongodb://127.0.0.1:{port}"
+    client = MongoClient(url, serverSelectionTimeoutMS=500)
+    wait_until(lambda: client.admin.command("ping"), 30, "mongod")
+    client.close()
+    return process, url, data_directory
+
+
+def seed(url, database_name, users, assets):
+    client = MongoClient(url)
+    db = client[database_name]
+    hashed_password = get_hashed_password(PASSWORD) # Hashed once, bcrypt would dominate the seeding otherwise
+
+    emails = [f"bench{index}@example.com" for index in range(users)]
+    db.users.insert_many([
+        {"username": f"bench{index}", "email": email, "password": hashed_password, "role": "user"}
+        for index, email in enumerate(emails)
+    ])
+
+    # Spread over 15 days so that part of the archive has already faded out of the scatter page
+    now = datetime.datetime.now(datetime.timezone.utc)
+    asset_ids = []
+    batch = []
+    for index in range(assets):
+        asset_id = ObjectId()
+        asset_ids.append(str(asset_id))
+        batch.append({
+            "_id": asset_id,
+            "title": f"Benchmark asset {index}",
+            "disaster": random.choice(["Flood", "Fire", "Storm", "Earthquake"]),
+            "place": f"City {index % 100}",
+            "geolocation": f"{random.uniform(-60, 60):.6f}, {random.uniform(-180, 180):.6f}",
+            "src": f"https://www.example.com/image-{index}.jpg",
+            "user_id": ObjectId(),
+            "created_at": now - datetime.timedelta(seconds=random.uniform(0, 15 * 24 * 60 * 60)),
+        })
+        if len(batch) == 1000:
+            db.assets.insert_many(batch)
+            batch = []
+    if batch:
+        db.assets.insert_many(batch)
+
+    client.close()
+    return emails, asset_ids
+
+
+def start_app(url, database_name, port, workers):
+    env = dict(os.environ)
+    env.update({
+        "MONGO_CONNECTION_URL": url,
+        "DATABASE_NAME": database_name,
+        "JWT_SECRET_KEY": env.get("JWT_SECRET_KEY", "benchmark-secret"),
+        "JWT_REFRESH_SECRET_KEY": env.get("JWT_REFRESH_SECRET_KEY", "benchmark-refresh-secret"),
+        "AUTH_RATE_PER_MINUTE": "0", # Every request comes from 127.0.0.1, the login scenario would only measure 429s
+    })
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--factory", "main:create_app", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+    )
+    wait_until(lambda: httpx.get(f"http://127.0.0.1:{port}/asset/scatter").status_code == 200, 60, "the app")
+    return process
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(fraction * len(values) + 0.5) - 1)) # Nearest rank
+    return values[index]
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    shed = sum(count for status, count in statuses.items() if status in (429, 503)) # Rejected on purpose by the server
+    errors = sum(count for status, count in statuses.items() if status == 0 or status >= 400) - shed
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "shed": shed,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            "p50": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+            "p95": round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+            "p99": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+            "max": round(latencies[-1] * 1000, 3) if latencies else None,
+        },
+    }
+
+
+# Each scenario is a coroutine function sending one request and returning the response
+def build_scenarios(emails, asset_ids, tokens):
+    async def scatter(client):
+        return await client.get("/asset/scatter")
+
+    async def newest(client):
+        return await client.get("/asset/new")
+
+    async def asset(client):
+        return await client.get(f"/asset/{random.choice(asset_ids)}")
+
+    async def login(client):
+        return await client.post("/user/login", data={"username": random.choice(emails), "password": PASSWORD})
+
+    async def create(client):
+        headers = {"Authorization": f"Bearer {random.choice(tokens)}"}
+        body = {"title": "Benchmark upload", "src": f"https://www.example.com/{uuid.uuid4()}.jpg"}
+        return await client.post("/asset/create", json=body, headers=headers)
+
+    return {
+        "scatter": scatter,
+        "asset_new": newest,
+        "asset_by_id": asset,
+        "login": login,
+        "asset_create": create,
+    }
+
+
+# Runs `concurrency` workers picking among `scenarios` for `duration` seconds, latencies are recorded per scenario
+async def drive(base_url, scenarios, concurrency, duration):
+    results = {name: ([], {}) for name in scenarios}
+    names = list(scenarios)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = random.choice(names)
+                latencies, statuses = results[name]
+                start = time.perf_counter()
+                try:
+                    response = await scenarios[name](client)
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = 0
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {name: summarize(latencies, statuses, elapsed) for name, (latencies, statuses) in results.items()}
+
+
+async def get_tokens(base_url, emails, count):
+    tokens = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        for email in emails[:count]:
+            response = await client.post("/user/login", data={"username": email, "password": PASSWORD})
+            response.raise_for_status()
+            tokens.append(response.json()["access_token"])
+    return tokens
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args, base_url, emails, asset_ids):
+    tokens = await get_tokens(base_url, emails, min(len(emails), 10))
+    scenarios = build_scenarios(emails, asset_ids, tokens)
+
+    report = {}
+    # Every route alone first, then all of them at once to see how they affect each other
+    for name, scenario in scenarios.items():
+        print(f"Running {name} ...")
+        report[name] = (await drive(base_url, {name: scenario}, args.concurrency, args.duration))[name]
+    print("Running mixed ...")
+    report["mixed"] = await drive(base_url, scenarios, args.concurrency, args.duration)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark for the API hot paths")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--assets", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per scenario")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the generated data and of the requests picked by the scenarios")
+    parser.add_argument("--mongo-url", help="Use this MongoDB instead of starting a mongod, a throw-away database is created")
+    parser.add_argument("--mongod", default=os.getenv("MONGOD_BINARY", "mongod"), help="mongod binary")
+    parser.add_argument("--output", help="Report path, defaults to benchmarks/results/load-<timestamp>.json")
+    args = parser.parse_args()
+    random.seed(args.seed) # Same documents and request sequence from one run to the next, so that the reports compare
+
+    mongod = None
+    data_directory = None
+    app = None
+    database_name = f"bench_{uuid.uuid4().hex[:8]}"
+    url = args.mongo_url
+    try:
+        if not url:
+            binary = shutil.which(args.mongod)
+            if not binary:
+                parser.error("mongod was not found, install it or pass --mongo-url")
+            mongod, url, data_directory = start_mongod(binary)
+
+        print(f"Seeding {args.users} users and {args.assets} assets ...")
+        emails, asset_ids = seed(url, database_name, args.users, args.assets)
+
+        port = get_free_port()
+        app = start_app(url, database_name, port, args.workers)
+        scenarios = asyncio.run(run(args, f"http://127.0.0.1:{port}", emails, asset_ids))
+    finally:
+        if app:
+            app.terminate()
+            app.wait()
+        if args.mongo_url:
+            client = MongoClient(url)
+            client.drop_database(database_name)
+            client.close()
+        if mongod:
+            mongod.terminate()
+            mongod.wait()
+        if data_directory:
+            shutil.rmtree(data_directory, ignore_errors=True)
+
+    finished_at = datetime.datetime.now(datetime.timezone.utc)
+    report = {
+        "finished_at": finished_at.isoformat(),
+        "git_commit": get_git_commit(),
+        "config": {
+            "users": args.users,
+            "assets": args.assets,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "workers": args.workers,
+            "seed": args.seed,
+        },
+        "scenarios": scenarios,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY, f"load-{finished_at.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    for name, summary in scenarios.items():
+        if name == "mixed":
+            continue
+        latency = summary["latency_ms"]
+        print(f"{name:<14} {summary['throughput_rps']:>10} req/s  p50 {latency['p50']} ms  p95 {latency['p95']} ms  p99 {latency['p99']} ms  errors {summary['errors']}")
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
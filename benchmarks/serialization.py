@@ -0,0 +1,99 @@
+# Compares the per document Pydantic serialization with the fast path of utils/serialization
+# Run from the repository root with `python -m benchmarks.serialization [sizes...]`, e.g. `python -m benchmarks.serialization 1000 10000 100000`
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from bson import ObjectId
+from models.upload_image import AssetBase, AssetScatter
+from utils.serialization import asset_document, dumps
+import datetime
+import json
+import sys
+import time
+
+
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+REPEAT = 3
+
+scatter_adapter = TypeAdapter(list[AssetScatter])
+
+
+# Same encoding as FastAPI's JSONResponse
+def render_json(content):
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+def make_documents(size):
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    example = AssetBase.model_config["json_schema_extra"]["example"]
+    documents = []
+    for index in range(size):
+        document = {key: value for key, value in example.items() if key != "_id"}
+        document["_id"] = ObjectId()
+        document["user_id"] = ObjectId()
+        document["src"] = f"https://www.example.com/image-{index}.jpg"
+        document["created_at"] = now - datetime.timedelta(minutes=index)
+        documents.append(document)
+    return documents
+
+
+# Scatter documents as returned by the previous find() and by the current aggregation pipeline
+def make_scatter_documents(documents):
+    raw = [{"_id": document["_id"], "src": document["src"], "scale": 0.5} for document in documents]
+    projected = [{"_id": str(document["_id"]), "src": document["src"], "scale": 0.5} for document in documents]
+    return raw, projected
+
+
+def scatter_models(raw):
+    return render_json([AssetScatter(**asset).model_dump(by_alias=True, include=["src", "scale", "id"]) for asset in raw])
+
+
+def scatter_type_adapter(raw):
+    return scatter_adapter.dump_json(scatter_adapter.validate_python(raw), by_alias=True, include={"__all__": {"id", "src", "scale"}})
+
+
+def scatter_fast(projected):
+    return dumps(projected)
+
+
+def details_models(documents):
+    return [render_json(AssetBase(**asset).model_dump(mode="json", by_alias=True, exclude=["id"])) for asset in documents]
+
+
+def details_fast(documents):
+    return [dumps(asset_document(asset)) for asset in documents]
+
+
+def measure(function, argument):
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(sizes):
+    print(f"{'size':>8} {'case':<28} {'best (ms)':>10} {'speedup':>8}")
+    for size in sizes:
+        documents = make_documents(size)
+        raw, projected = make_scatter_documents(documents)
+
+        cases = [
+            ("scatter: model per document", scatter_models, raw),
+            ("scatter: batch TypeAdapter", scatter_type_adapter, raw),
+            ("scatter: projected + orjson", scatter_fast, projected),
+            ("detail: model per document", details_models, documents),
+            ("detail: fast path + orjson", details_fast, documents),
+        ]
+        baselines = {}
+        for name, function, argument in cases:
+            elapsed = measure(function, argument)
+            kind = name.split(":")[0]
+            baselines.setdefault(kind, elapsed)
+            print(f"{size:>8} {name:<28} {elapsed * 1000:>10.1f} {baselines[kind] / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
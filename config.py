@@ -0,0 +1,89 @@
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import Optional, Union, get_args, get_origin, get_type_hints
+import dotenv
+import os
+
+
+
+# Every setting is read from the environment variable of the same name in upper case (e.g. SCATTER_CACHE_TTL)
+@dataclass(frozen=True)
+class Settings:
+    # MongoDB
+    mongo_connection_url: Optional[str] = None
+    database_name: Optional[str] = None
+    mongo_max_pool_size: Optional[int] = None # Unset pool options keep the driver defaults
+    mongo_min_pool_size: Optional[int] = None
+    mongo_max_idle_time_ms: Optional[int] = None
+    mongo_wait_queue_timeout_ms: Optional[int] = None
+    mongo_connect_timeout_ms: Optional[int] = None
+    mongo_socket_timeout_ms: Optional[int] = None
+    mongo_server_selection_timeout_ms: Optional[int] = None
+    mongo_ensure_indexes: str = "1" # 1 to create missing indexes, dry-run to only report them, 0 to skip
+    legacy_created_at_timezone: str = "UTC" # Timezone the legacy `created_at` strings were written in
+    mongo_migrate_created_at: bool = True # Convert the legacy `created_at` strings on start up, the date queries skip them
+
+    # Authentication
+    jwt_secret_key: Optional[str] = None
+    jwt_refresh_secret_key: Optional[str] = None
+    bcrypt_rounds: int = 12 # Cost factor of newly hashed passwords
+    password_hash_workers: int = 2
+    password_hash_queue_size: int = 32
+    password_hash_executor: str = "thread" # thread or process
+    user_cache_size: int = 1024
+    user_cache_ttl: float = 60 # Seconds a role change made on another worker can go unnoticed
+
+    # Assets
+    scatter_batch_size: int = 500 # Number of documents pulled from the cursor per streamed chunk
+    scatter_cache_ttl: float = 30 # Upper bound in seconds on how stale another worker's writes can look
+    scatter_compress_min_size: int = 1024 # Smaller payloads are sent uncompressed
+    scatter_gzip_level: int = 9
+    scatter_brotli_quality: int = 11
+    scatter_delta_overlap: float = 5 # Seconds of inserts sent again by ?since= to cover IDs committed out of order
+    asset_feed_queue_size: int = 16 # Events kept per subscriber before the oldest are dropped
+    asset_feed_heartbeat: float = 15 # Seconds between keep-alive comments on idle feeds
+    asset_feed_change_stream: bool = False # Feed the broadcaster from a MongoDB change stream (replica set only)
+    bulk_insert_batch_size: int = 500 # Documents per insert_many call
+    bulk_max_items: int = 10000 # Items accepted by one bulk request
+    asset_cache_size: int = 1024 # Serialized asset responses kept in memory
+    asset_cache_ttl: float = 3600
+    asset_batch_max_ids: int = 200 # IDs accepted by one batch request
+    media_chunk_size: int = 255 * 1024 # Bytes read from GridFS per streamed chunk
+    media_max_upload_size: int = 0 # Bytes accepted per file, 0 for no limit
+
+    # Admission control
+    admission_limits: str = "POST /user/login=16:64, POST /user/register=16:64, GET /asset/search=16:64, GET /asset/near=16:64, GET /asset/within=16:64, POST /asset/bulk=2:8, POST /asset/upload=4:16" # METHOD /path=max_concurrent:max_queue
+    admission_queue_timeout: float = 5 # Seconds a queued request waits for a slot before 503
+    scatter_max_concurrent: int = 4 # Scatter snapshot rebuilds, NDJSON streams and ?since= deltas running at once
+    scatter_max_queue: int = 16
+    auth_rate_per_minute: float = 10 # Login and register attempts per client address, 0 to disable
+    auth_rate_burst: int = 5
+    auth_rate_clients: int = 10000 # Client buckets kept per worker
+
+    # Monitoring
+    slow_request_seconds: float = 0 # Log the phase breakdown of slower requests, 0 to disable
+
+    @classmethod
+    def from_env(cls):
+        dotenv.load_dotenv()
+        hints = get_type_hints(cls)
+        values = {}
+        for field in fields(cls):
+            value = os.getenv(field.name.upper())
+            if value is None or value == "":
+                continue
+
+            kind = hints[field.name]
+            if get_origin(kind) is Union: # Optional[...]
+                kind = next(arg for arg in get_args(kind) if arg is not type(None))
+            if kind is bool:
+                values[field.name] = value.strip().lower() in ("1", "true", "yes", "on")
+            else:
+                values[field.name] = kind(value)
+        return cls(**values)
+
+
+# Settings of the process, loaded once on first use
+@lru_cache
+def get_settings() -> Settings:
+    return Settings.from_env()
@@ -1 +1,5 @@
-from .connection import DBConnection
\ No newline at end of file
+from .connection import DBConnection
+from .upload_image import AssetDB
+from .users import UserDB
+from .dependencies import get_asset_db, get_user_db
+from .indexes import ensure_indexes
@@ -1,19 +1,49 @@
 from motor.motor_asyncio import AsyncIOMotorClient as MongoClient
 
 
+
+# Connection pool options of the client and the settings they are read from, unset values keep the driver defaults
+POOL_OPTIONS = {
+    "maxPoolSize": "mongo_max_pool_size",
+    "minPoolSize": "mongo_min_pool_size",
+    "maxIdleTimeMS": "mongo_max_idle_time_ms",
+    "waitQueueTimeoutMS": "mongo_wait_queue_timeout_ms",
+    "connectTimeoutMS": "mongo_connect_timeout_ms",
+    "socketTimeoutMS": "mongo_socket_timeout_ms",
+    "serverSelectionTimeoutMS": "mongo_server_selection_timeout_ms",
+}
+
+
+def get_pool_options(settings):
+    options = {}
+    for option, setting in POOL_OPTIONS.items():
+        value = getattr(settings, setting)
+        if value is not None:
+            options[option] = value
+    return options
+
+
+# Owns the single MongoDB client (and so the single connection pool) of the process
+# The data access classes receive `db` from here instead of opening their own clients
 class DBConnection:
-    def __init__(self, connection_url, database_name):
+    def __init__(self, connection_url, database_name, **client_options):
         self.connection_url = connection_url
         self.database_name = database_name
+        self.client_options = client_options
         self.client = None
         self.db = None
 
+    # Built from the settings, `client_options` are added to the pool options (e.g. event_listeners)
+    @classmethod
+    def from_settings(cls, settings, **client_options):
+        return cls(settings.mongo_connection_url, settings.database_name, **get_pool_options(settings), **client_options)
+
     def connect(self):
-        self.client = MongoClient(self.connection_url)
+        self.client = MongoClient(self.connection_url, **self.client_options)
         self.db = self.client[self.database_name]
         print("\nConnected to the database")
 
     def disconnect(self):
         if self.client:
             self.client.close()
-            print("\nDisconnected from the database")
\ No newline at end of file
+            print("\nDisconnected from the database")
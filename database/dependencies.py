@@ -0,0 +1,14 @@
+from fastapi import Request
+from database.upload_image import AssetDB
+from database.users import UserDB
+
+
+
+# The data access classes are created once in the app lifespan on top of the shared connection
+
+def get_asset_db(request: Request) -> AssetDB:
+    return request.app.state.asset_db
+
+
+def get_user_db(request: Request) -> UserDB:
+    return request.app.state.user_db
@@ -0,0 +1,93 @@
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+from database.connection import DBConnection
+from database.upload_image import ASSETS_COLLECTION_NAME
+from database.users import USERS_COLLECTION_NAME
+from config import get_settings
+import asyncio
+import sys
+
+
+
+# Indexes the data access layer relies on, per collection
+INDEXES = {
+    USERS_COLLECTION_NAME: [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True), # Login lookups and atomic duplicate registration check
+    ],
+    ASSETS_COLLECTION_NAME: [
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"), # Scatter window and search order
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("disaster", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="disaster_created_at"), # Search by disaster and date range
+        IndexModel([("location", GEOSPHERE)], name="location_2dsphere"), # Map viewport queries, assets without a location are left out
+        IndexModel(
+            [("title", TEXT), ("keywords", TEXT), ("disaster", TEXT), ("place", TEXT), ("affectedAreas", TEXT)],
+            name="search_text",
+            weights={"title": 5, "keywords": 5, "disaster": 3, "place": 2, "affectedAreas": 1},
+        ),
+    ],
+}
+
+
+# MongoDB reports the fields of a text index as `_fts`/`_ftsx` whatever they are, the weights tell them apart
+def get_index_keys(keys):
+    index_keys = []
+    for field, direction in keys.items():
+        if direction != TEXT:
+            index_keys.append((field, direction))
+        elif ("_fts", TEXT) not in index_keys:
+            index_keys += [("_fts", TEXT), ("_ftsx", 1)]
+    return tuple(index_keys)
+
+
+# Creates the missing indexes, existing ones are matched on their keys so this is safe to run on every start up
+# With dry_run nothing is created and the report tells what would be
+async def ensure_indexes(db, dry_run=False):
+    report = []
+    for collection_name, indexes in INDEXES.items():
+        collection = db.get_collection(collection_name)
+        existing_indexes = {}
+        for info in (await collection.index_information()).values():
+            existing_indexes[tuple(tuple(key) for key in info["key"])] = info
+
+        for index in indexes:
+            document = index.document
+            keys = get_index_keys(document["key"])
+            entry = {"collection": collection_name, "name": document["name"], "keys": dict(document["key"])}
+
+            existing = existing_indexes.get(keys)
+            if existing is not None:
+                # Same keys with different options can not be fixed automatically, the old index has to be dropped by hand
+                same_options = existing.get("unique", False) == document.get("unique", False)
+                if "weights" in document: # A text index over other fields
+                    same_options = same_options and existing.get("weights") == document["weights"]
+                entry["status"] = "exists" if same_options else "conflict"
+            elif dry_run:
+                entry["status"] = "missing"
+            else:
+                try:
+                    await collection.create_indexes([index])
+                    entry["status"] = "created"
+                except OperationFailure as error: # e.g. duplicated emails preventing the unique index
+                    entry["status"] = "failed"
+                    entry["error"] = str(error)
+
+            if entry["status"] != "exists":
+                print(f"\nIndex {collection_name}.{entry['name']} {entry['keys']}: {entry['status']} {entry.get('error', '')}".rstrip())
+            report.append(entry)
+
+    return report
+
+
+# Run with `python -m database.indexes [--dry-run]`
+async def main(dry_run):
+    db_connection = DBConnection.from_settings(get_settings())
+    db_connection.connect()
+    try:
+        for entry in await ensure_indexes(db_connection.db, dry_run=dry_run):
+            print(entry)
+    finally:
+        db_connection.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main("--dry-run" in sys.argv))
@@ -0,0 +1,67 @@
+from database.connection import DBConnection
+from database.upload_image import ASSETS_COLLECTION_NAME
+from config import get_settings
+from pymongo import UpdateOne
+from utils.geolocation import parse_geolocation
+import asyncio
+
+
+# Converts the legacy `created_at` strings (like 2024-08-01 07:42:53) into native BSON dates
+# The conversion runs entirely inside MongoDB and is safe to run more than once
+async def migrate_created_at(db, timezone):
+    assets_collection = db.get_collection(ASSETS_COLLECTION_NAME)
+    result = await assets_collection.update_many(
+        {"created_at": {"$type": "string"}},
+        [{
+            "$set": {
+                "created_at": {
+                    "$dateFromString": {
+                        "dateString": "$created_at",
+                        "format": "%Y-%m-%d %H:%M:%S",
+                        "timezone": timezone, # The legacy strings came from the server local clock
+                        "onError": "$created_at", # Leave values that can not be parsed untouched
+                    }
+                }
+            }
+        }],
+    )
+    print(f"\nMigrated created_at on {result.modified_count} assets")
+    return result.modified_count
+
+
+# Fills the GeoJSON `location` of the assets created before it was parsed from `geolocation`
+# Uses the same parser as the API, unparsable values are marked with a null location so they are not read again
+async def migrate_location(db, batch_size=1000):
+    assets_collection = db.get_collection(ASSETS_COLLECTION_NAME)
+    cursor = assets_collection.find({"location": {"$exists": False}}, {"geolocation": 1}, batch_size=batch_size)
+    modified_count = 0
+    located_count = 0
+    batch = []
+    async for asset in cursor:
+        location = parse_geolocation(asset.get("geolocation"))
+        located_count += location is not None
+        batch.append(UpdateOne({"_id": asset["_id"]}, {"$set": {"location": location}}))
+        if len(batch) >= batch_size:
+            modified_count += (await assets_collection.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        modified_count += (await assets_collection.bulk_write(batch, ordered=False)).modified_count
+
+    print(f"\nMigrated location on {modified_count} assets, {located_count} with a valid geolocation")
+    return modified_count
+
+
+async def run_migrations():
+    settings = get_settings()
+    db_connection = DBConnection.from_settings(settings)
+    db_connection.connect()
+    try:
+        await migrate_created_at(db_connection.db, settings.legacy_created_at_timezone)
+        await migrate_location(db_connection.db)
+    finally:
+        db_connection.disconnect()
+
+
+# Run with `python -m database.migrations`
+if __name__ == "__main__":
+    asyncio.run(run_migrations())
@@ -1,47 +1,154 @@
-from motor.motor_asyncio import AsyncIOMotorClient as MongoClient
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
 from pymongo import DESCENDING
+from pymongo.errors import BulkWriteError
 from bson import ObjectId
-import dotenv
-import os
-
-
-
-dotenv.load_dotenv()
-
-MONGO_CONNECTION_URL = os.getenv("MONGO_CONNECTION_URL")
-DATABASE_NAME = os.getenv("DATABASE_NAME")
+from utils.scale_image import get_fade_cutoff, scale_expression, scale_change_expression, scale_changes_filter
 
 
 # Replace this with your MongoDB collection name for assets
 ASSETS_COLLECTION_NAME = "assets"
+MEDIA_BUCKET_NAME = "media" # GridFS bucket holding the uploaded media files (media.files and media.chunks)
 
 
 class AssetDB:
-    def __init__(self):
-        self.client = MongoClient(MONGO_CONNECTION_URL)
-        self.db = self.client[DATABASE_NAME]
+    def __init__(self, db):
+        self.db = db
         self.assets_collection = self.db.get_collection(ASSETS_COLLECTION_NAME)
+        self.media_bucket = AsyncIOMotorGridFSBucket(self.db, bucket_name=MEDIA_BUCKET_NAME)
 
     async def create_asset(self, asset_data):
         new_asset = await self.assets_collection.insert_one(asset_data)
         new_asset_id = str(new_asset.inserted_id)
         return new_asset_id
+
+    # Unordered insert, the driver sets `_id` on every document and the failed ones are returned by their position
+    async def create_assets(self, assets_data):
+        try:
+            await self.assets_collection.insert_many(assets_data, ordered=False)
+        except BulkWriteError as error:
+            return {write_error["index"]: write_error["errmsg"] for write_error in error.details["writeErrors"]}
+        return {}
     
-    async def get_scatter_assets(self):
-        projection = {
-            "_id": 1,
-            "src": 1,
-            "created_at": 1
-        }
-
-        assets = await self.assets_collection.find({}, projection).to_list(length=None)
+    # Assets whose scale already reached 0 are filtered out and the scale is computed by MongoDB
+    # The scales are taken at `now` when given, so that they match the time of a delta sync cursor
+    def get_scatter_pipeline(self, match=None, now=None):
+        return [
+            {"$match": {"created_at": {"$gt": get_fade_cutoff(now)}, **(match or {})}},
+            {"$project": {"_id": {"$toString": "$_id"}, "src": {"$ifNull": ["$src", None]}, "scale": scale_expression(now=now or "$$NOW")}}, # Final JSON shape, no per document work left
+        ]
+
+    async def get_scatter_assets(self, now=None):
+        assets = await self.assets_collection.aggregate(self.get_scatter_pipeline(now=now)).to_list(length=None)
         return assets
 
-    async def get_asset(self, asset_id):
-        asset = await self.assets_collection.find_one({"_id": ObjectId(asset_id)})
+    # Scatter assets inserted after `after_id`, in insertion order through the _id index
+    async def get_scatter_assets_after(self, after_id, now=None):
+        pipeline = self.get_scatter_pipeline({"_id": {"$gt": after_id}}, now)
+        pipeline.insert(1, {"$sort": {"_id": 1}})
+        assets = await self.assets_collection.aggregate(pipeline).to_list(length=None)
+        return assets
+
+    # Assets up to `last_id` whose scale changed between `since` and `until`, with their current scale (0 once faded)
+    async def get_scatter_changes(self, last_id, since, until):
+        pipeline = [
+            {"$match": {**scale_changes_filter(since, until), "_id": {"$lte": last_id}}},
+            {"$project": {"_id": {"$toString": "$_id"}, "scale": scale_expression(now=until)}},
+        ]
+        assets = await self.assets_collection.aggregate(pipeline).to_list(length=None)
+        return assets
+
+    # Seconds until the scale of any scatter asset changes, None when there is no asset to display
+    async def get_scatter_refresh_in(self):
+        pipeline = [
+            {"$match": {"created_at": {"$gt": get_fade_cutoff()}}},
+            {"$group": {"_id": None, "refresh_in": {"$min": scale_change_expression()}}},
+        ]
+
+        result = await self.assets_collection.aggregate(pipeline).to_list(length=1)
+        if not result:
+            return None
+        return result[0]["refresh_in"] / 1000
+
+    # Yields the scatter assets one cursor batch at a time so the whole collection is never held in memory
+    async def iter_scatter_assets(self, batch_size):
+        cursor = self.assets_collection.aggregate(self.get_scatter_pipeline(), batchSize=batch_size)
+        while True:
+            assets = await cursor.to_list(length=batch_size)
+            if not assets:
+                break
+            yield assets
+
+    async def get_asset(self, asset_id, projection=None):
+        asset = await self.assets_collection.find_one({"_id": ObjectId(asset_id)}, projection)
         return asset
     
+    # Resolves many assets with a single $in query, the order of the result is not the order of asset_ids
+    async def get_assets(self, asset_ids, projection=None):
+        assets = await self.assets_collection.find({"_id": {"$in": asset_ids}}, projection).to_list(length=None)
+        return assets
+
+    # Text matches ranked by relevance when `text` is given, newest first otherwise
+    # `after` is (sort_value, _id) of the last asset of the previous page, the assets come with a `score` when ranked
+    async def search_assets(self, filters, text=None, after=None, limit=20, projection=None):
+        match = dict(filters)
+        pipeline = [{"$match": match}]
+        if text:
+            match["$text"] = {"$search": text}
+            pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+            sort_key = "score"
+        else:
+            # Only native dates can be ordered and paged through, legacy string dates are left out until migrated
+            match["created_at"] = {"$type": "date", **match.get("created_at", {})}
+            sort_key = "created_at"
+
+        if after is not None:
+            value, after_id = after
+            keyset = {"$or": [{sort_key: {"$lt": value}}, {sort_key: value, "_id": {"$lt": after_id}}]}
+            if text:
+                pipeline.append({"$match": keyset}) # The score only exists after $addFields
+            else:
+                match.update(keyset)
+
+        pipeline.append({"$sort": {sort_key: -1, "_id": -1}})
+        pipeline.append({"$limit": limit})
+        if projection is not None:
+            pipeline.append({"$project": {**projection, "_id": 1, sort_key: 1}}) # Sort values are needed for the next cursor
+        assets = await self.assets_collection.aggregate(pipeline).to_list(length=limit)
+        return assets
+
+    # `$geoNear` sorts by distance and adds the `distance` in meters, it has to be the first stage
+    async def get_assets_near(self, point, radius, limit, projection=None):
+        pipeline = [
+            {"$geoNear": {"near": point, "key": "location", "distanceField": "distance", "maxDistance": radius, "spherical": True}},
+            {"$limit": limit},
+        ]
+        if projection is not None:
+            pipeline.append({"$project": {**projection, "_id": 1, "distance": 1}})
+        assets = await self.assets_collection.aggregate(pipeline).to_list(length=limit)
+        return assets
+
+    async def get_assets_within(self, geometry, limit, projection=None):
+        if projection is not None:
+            projection = {**projection, "_id": 1}
+        cursor = self.assets_collection.find({"location": {"$geoWithin": {"$geometry": geometry}}}, projection)
+        assets = await cursor.sort([("created_at", DESCENDING), ("_id", DESCENDING)]).limit(limit).to_list(length=limit)
+        return assets
+
     async def get_newest_asset(self):
         asset = await self.assets_collection.find_one(sort=[("_id", DESCENDING)]) # Find the newest document
         return asset
-    
\ No newline at end of file
+
+    # Media files are written chunk by chunk into GridFS through the returned stream (write, close or abort)
+    def open_media_upload(self, filename, content_type):
+        return self.media_bucket.open_upload_stream(filename or "upload", metadata={"contentType": content_type})
+
+    async def delete_media(self, file_id):
+        await self.media_bucket.delete(file_id)
+
+    # Returns a readable and seekable stream over the file, None when it does not exist
+    async def open_media_download(self, file_id):
+        try:
+            return await self.media_bucket.open_download_stream(file_id)
+        except NoFile:
+            return None
@@ -1,25 +1,14 @@
-from motor.motor_asyncio import AsyncIOMotorClient as MongoClient
-from pymongo import DESCENDING
+from pymongo import DESCENDING, ReturnDocument
 from bson import ObjectId
-import dotenv
-import os
 from models.users import UserBase
 
 
-
-dotenv.load_dotenv()
-
-MONGO_CONNECTION_URL = os.getenv("MONGO_CONNECTION_URL")
-DATABASE_NAME = os.getenv("DATABASE_NAME")
-
-
 # Replace this with your MongoDB collection name for users
 USERS_COLLECTION_NAME = "users"
 
 class UserDB:
-    def __init__(self):
-        self.client = MongoClient(MONGO_CONNECTION_URL)
-        self.db = self.client[DATABASE_NAME]
+    def __init__(self, db):
+        self.db = db
         self.users_collection = self.db.get_collection(USERS_COLLECTION_NAME)
 
     async def create_user(self, user_data):
@@ -27,18 +16,18 @@ class UserDB:
         new_user_id = str(new_user.inserted_id)
         return new_user_id
     
-    def get_all_user(self, id, limit):
-        if not id or id == "null":
-            users_cursor = self.users_collection.find({}, {"password": False}).sort([("_id", DESCENDING)]).limit(limit) # Find the documents after the given id and get 'limit' number of rows
-            users_list = list(users_cursor)
-            return users_list
-        user = self.users_collection.find_one({"_id": ObjectId(id)}) # Find the document with the given id
-        if not user:
-            return None
-        
-        users_cursor = self.users_collection.find({"_id": {"$lt": ObjectId(id)}}).sort([("_id", DESCENDING)]).limit(limit) # Find the documents after the given id and get 'limit' number of rows
-        users_list = list(users_cursor)
-        return users_list
+    # Keyset pagination on _id, newest users first, the page starts right after `after_id` without looking it up
+    async def get_users_page(self, after_id, limit):
+        query = {"_id": {"$lt": after_id}} if after_id else {}
+        projection = {
+            "_id": 1,
+            "username": 1,
+            "email": 1,
+            "role": 1
+        }
+
+        users = await self.users_collection.find(query, projection).sort([("_id", DESCENDING)]).limit(limit).to_list(length=limit)
+        return users
 
     async def get_user(self, user_id):
         user = await self.users_collection.find_one({"_id": ObjectId(user_id)})
@@ -47,4 +36,13 @@ class UserDB:
     async def get_user_email(self, email):
         user = await self.users_collection.find_one({"email": email})
         return user
+
+    async def update_user_role(self, user_id, role):
+        user = await self.users_collection.find_one_and_update(
+            {"_id": ObjectId(user_id)},
+            {"$set": {"role": role}},
+            projection={"password": False},
+            return_document=ReturnDocument.AFTER,
+        )
+        return user
     
\ No newline at end of file
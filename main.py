@@ -1,54 +1,148 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from database import DBConnection
+from database import DBConnection, AssetDB, UserDB, ensure_indexes
+from database.migrations import migrate_created_at
 from contextlib import asynccontextmanager
-import os
-import dotenv
-from services import auth, upload_image
+import asyncio
+from config import get_settings
+from utils.admission import AdmissionMiddleware, ConcurrencyLimiter, MemoryBucketStorage, RateLimiter, build_limiters
+from services import auth, upload_image, media, metrics as metrics_service
+from utils.broadcaster import AssetBroadcaster
+from utils.cache import TTLCache
+from utils.metrics import MetricsRegistry, MetricsMiddleware, MongoCommandMetrics
+from utils.password_hasher import PasswordHasher
+from utils.scatter_cache import ScatterCache
 
 
-dotenv.load_dotenv()
 ORIGINS = ["*"]
-MONGO_CONNECTION_URL = os.getenv("MONGO_CONNECTION_URL")
-DATABASE_NAME = os.getenv("DATABASE_NAME")
-db_connection = DBConnection(MONGO_CONNECTION_URL, DATABASE_NAME)
 
 
+PASSWORD_HASHER_COUNTERS = ("completed", "failed", "rejected")
+
+
+# Route label and limiter of every concurrency limit, the scatter one is taken by the route itself
+def get_limiters(state):
+    limiters = [(f"{method} {path}", limiter) for (method, path), limiter in state.limiters.items()]
+    limiters.append(("GET /asset/scatter", state.scatter_limiter))
+    return limiters
+
+
+# Point in time values exposed next to the request and MongoDB metrics
+def collect_gauges(state):
+    gauges = [(f"password_hasher_{name}", {}, value) for name, value in state.password_hasher.stats().items() if name not in PASSWORD_HASHER_COUNTERS]
+    gauges.append(("asset_feed_subscribers", {}, len(state.asset_feed.subscribers)))
+    for name, cache in (("token", state.token_cache), ("user", state.user_cache), ("asset", state.asset_cache)):
+        gauges.append(("cache_entries", {"cache": name}, len(cache)))
+    for route, limiter in get_limiters(state):
+        for name, value in limiter.stats().items():
+            if name != "rejected":
+                gauges.append((f"admission_{name}", {"route": route}, value))
+    if state.rate_limiter is not None and hasattr(state.rate_limiter.storage, "__len__"):
+        gauges.append(("rate_limit_clients", {}, len(state.rate_limiter.storage)))
+    return gauges
+
+
+# Totals since the worker started, exported as counters so that rate() can be used on them
+def collect_counters(state):
+    stats = state.password_hasher.stats()
+    counters = [(f"password_hasher_{name}", {}, stats[name]) for name in PASSWORD_HASHER_COUNTERS]
+    for name, cache in (("token", state.token_cache), ("user", state.user_cache), ("asset", state.asset_cache)):
+        counters.append(("cache_hits", {"cache": name}, cache.hits))
+        counters.append(("cache_misses", {"cache": name}, cache.misses))
+    for route, limiter in get_limiters(state):
+        counters.append(("admission_rejected", {"route": route}, limiter.rejected))
+    if state.rate_limiter is not None:
+        counters.append(("rate_limit_rejected", {}, state.rate_limiter.rejected))
+    return counters
+
+
+# Everything holding sockets, threads or locks is created here, in the worker that serves the requests,
+# so that nothing is inherited across a fork (gunicorn --preload, uvicorn --workers)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Start Up Event
+    settings = get_settings()
+    state = app.state
+    db_connection = DBConnection.from_settings(settings, event_listeners=[MongoCommandMetrics(state.metrics)])
     db_connection.connect()
+    if settings.mongo_ensure_indexes != "0":
+        await ensure_indexes(db_connection.db, dry_run=settings.mongo_ensure_indexes == "dry-run")
+    if settings.mongo_migrate_created_at: # Idempotent, a no-op once every date is native
+        await migrate_created_at(db_connection.db, settings.legacy_created_at_timezone)
+    state.asset_db = AssetDB(db_connection.db)
+    state.user_db = UserDB(db_connection.db)
+
+    state.password_hasher = PasswordHasher(settings.password_hash_workers, settings.password_hash_queue_size, use_processes=settings.password_hash_executor == "process")
+    state.token_cache = TTLCache(settings.user_cache_size, settings.user_cache_ttl)
+    state.user_cache = TTLCache(settings.user_cache_size, settings.user_cache_ttl)
+    state.scatter_cache = ScatterCache(settings.scatter_cache_ttl)
+    state.asset_cache = TTLCache(settings.asset_cache_size, settings.asset_cache_ttl)
+    state.asset_feed = AssetBroadcaster(settings.asset_feed_queue_size)
+    state.limiters = build_limiters(settings.admission_limits, settings.admission_queue_timeout)
+    state.scatter_limiter = ConcurrencyLimiter(settings.scatter_max_concurrent, settings.scatter_max_queue, settings.admission_queue_timeout)
+    state.rate_limiter = None
+    if settings.auth_rate_per_minute:
+        state.rate_limiter = RateLimiter(settings.auth_rate_per_minute, settings.auth_rate_burst, MemoryBucketStorage(settings.auth_rate_clients))
+    state.metrics.add_gauges(lambda: collect_gauges(state))
+    state.metrics.add_counters(lambda: collect_counters(state))
+
+    asset_feed_watcher = None
+    if settings.asset_feed_change_stream:
+        asset_feed_watcher = asyncio.create_task(state.asset_feed.watch(state.asset_db.assets_collection))
     print("\nS E R V E R   S T A R T I N G . . . . . . . . . .\n")
     yield
 
     # Shut Down Event
+    if asset_feed_watcher:
+        asset_feed_watcher.cancel()
+    state.password_hasher.shutdown()
     db_connection.disconnect()
     print("\nS E R V E R   S H U T D O W N . . . . . . . . . .\n")
 
 
+# Builds a new application, run it with `uvicorn --factory main:create_app`
+# Only cheap objects are created here, the connections, pools and caches are created by the lifespan
+def create_app() -> FastAPI:
+    settings = get_settings()
+    app = FastAPI(
+    #    docs_url=None, # Disable docs (Swagger UI)
+    #    redoc_url=None, # Disable redoc
+        title="Immersive Sky Expereie API",
+        description="API for Immersive Sky Experience",
+        version="1.0.0",
+        lifespan=lifespan
+    )
+    app.state.metrics = MetricsRegistry()
+
+    # Innermost, so that the rejections still get the CORS headers and are counted by the metrics under their route
+    app.add_middleware(AdmissionMiddleware)
 
-app = FastAPI(
-#    docs_url=None, # Disable docs (Swagger UI)
-#    redoc_url=None, # Disable redoc
-    title="Immersive Sky Expereie API",
-    description="API for Immersive Sky Experience",
-    version="1.0.0",
-    lifespan=lifespan
-)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[upload_image.SCATTER_CURSOR_HEADER], # Readable by the browser clients
+    )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    # Added last so that it is the outermost middleware and times the whole request
+    app.add_middleware(MetricsMiddleware, registry=app.state.metrics, slow_request_seconds=settings.slow_request_seconds)
 
 
-#  I N C L U D E   R O U T E R S
+    #  I N C L U D E   R O U T E R S
 
 
-app.include_router(auth.router, prefix="/user", tags=["USER"])
-app.include_router(upload_image.router, prefix="/asset", tags=["ASSET"])
+    app.include_router(auth.router, prefix="/user", tags=["USER"])
+    app.include_router(upload_image.router, prefix="/asset", tags=["ASSET"])
+    app.include_router(media.router, prefix="/asset", tags=["ASSET"])
+    app.include_router(metrics_service.router, tags=["METRICS"])
+    return app
 
 
+# Keeps `uvicorn main:app` working, the application is only built when it is first asked for
+def __getattr__(name):
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,11 +1,36 @@
-from pydantic import BaseModel, Field, BeforeValidator, ConfigDict
-from typing import Optional, Annotated
+from pydantic import BaseModel, Field, BeforeValidator, PlainSerializer, ConfigDict
+from typing import Optional, Annotated, List
+import datetime
 
 
+CREATED_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+
 # Represents an ObjectId field in the database.
 # It will be represented as a `str` on the model so that it can be serialized to JSON.
 PyObjectId = Annotated[str, BeforeValidator(str)]
 
+# Represents a date field stored as a native BSON date in the database.
+# It is kept as a `datetime` when dumped for MongoDB and rendered as `YYYY-MM-DD HH:MM:SS` (UTC) in JSON responses.
+MongoDateTime = Annotated[datetime.datetime, PlainSerializer(lambda value: value.strftime(CREATED_AT_FORMAT), return_type=str, when_used="json")]
+
+
+# `created_at` is set by the server, so whatever a client sends must not fail validation (e.g. archive imports in the legacy format)
+# ISO and legacy strings are parsed, anything else is dropped
+def parse_created_at(value):
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            pass
+        try:
+            return datetime.datetime.strptime(value, CREATED_AT_FORMAT)
+        except ValueError:
+            pass
+    return None
+
+
 class AssetBase(BaseModel):
     id: Optional[PyObjectId] = Field(alias="_id", default=None) # This will be aliased to `_id` when sent to MongoDB, but provided as `id` in the API requests and responses.
     title: Optional[str] = Field(None, description="Title of the event")
@@ -18,6 +43,7 @@ class AssetBase(BaseModel):
     place: Optional[str] = Field(None, description="Place where the event occurred")
     affectedAreas: Optional[str] = Field(None, description="Areas affected by the event")
     geolocation: Optional[str] = Field(None, description="Geolocation in Longitude/Latitude")
+    location: Optional[dict] = Field(None, description="GeoJSON Point parsed from the geolocation, set by the server")
     device: Optional[str] = Field(None, description="Device used")
     cameraModel: Optional[str] = Field(None, description="Model of the camera used")
     name: Optional[str] = Field(None, description="Name of the user if logged in")
@@ -43,7 +69,7 @@ class AssetBase(BaseModel):
     document: Optional[str] = Field(None, description="Document related to the event or record")
     src: Optional[str] = Field(None, description="Image sources")
     user_id: Optional[PyObjectId] = Field(None, alias="user_id", description="User ID if available") # This will be aliased to `user_id` when sent to MongoDB, but provided as `user_id` in the API requests and responses.
-    created_at: Optional[str] = Field(None, description="Date and time of creation")
+    created_at: Annotated[Optional[MongoDateTime], BeforeValidator(parse_created_at)] = Field(None, description="Date and time of creation")
 
     model_config = ConfigDict(
         populate_by_name=True, # Populate the model with the values from the JSON by name (e.g. `{"name": "Jane Doe"}` will populate the `name` field)
@@ -61,6 +87,7 @@ class AssetBase(BaseModel):
                 "place": "City A",
                 "affectedAreas": "Downtown, Uptown",
                 "geolocation": "34.052235, -118.243683",
+                "location": {"type": "Point", "coordinates": [-118.243683, 34.052235]},
                 "device": "Drone",
                 "cameraModel": "DJI Mavic Air 2",
                 "name": "John Doe",
@@ -108,3 +135,15 @@ class AssetScatter(AssetBase):
     )
 
 
+class AssetBatchRequest(BaseModel):
+    ids: List[str] = Field(..., description="IDs of the assets to fetch")
+    fields: Optional[List[str]] = Field(None, description="Only return these fields of the assets")
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "ids": ["5f4f7b4e5e9c4f001f6d8a4c", "5f4f7b4e5e9c4f001f6d8a4d"],
+                "fields": ["src", "title", "place"]
+            }
+        },
+    )
@@ -27,6 +27,18 @@ class UserBase(BaseModel):
     )
 
 
+class UserPublic(BaseModel):
+    id: Optional[PyObjectId] = Field(alias="_id", default=None)
+    username: str = Field(...)
+    email: EmailStr = Field(...)
+    role: str = Field(default="user")
+    model_config = ConfigDict(populate_by_name=True)
+
+
+class UserRoleUpdate(BaseModel):
+    role: str = Field(..., description="New role of the user, like admin, user or disabled")
+
+
 
 # AUTH MODELS
 
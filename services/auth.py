@@ -1,28 +1,34 @@
-from fastapi import APIRouter, HTTPException, Depends, Body
+from fastapi import APIRouter, HTTPException, Depends, Body, Query, Request
 from starlette import status
 from fastapi.security import OAuth2PasswordRequestForm
-from typing import Tuple
-from models.users import TokenSchema, UserBase
-from database.users import UserDB
+from typing import Tuple, Optional
+from models.users import TokenSchema, UserBase, UserPublic, UserRoleUpdate
+from database import UserDB, get_user_db
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
 import datetime
 import base64
+from utils.pagination import encode_cursor, decode_cursor
+from utils.admission import rate_limit
 from utils.auth import (
-    get_hashed_password,
+    PasswordHasher,
+    get_password_hasher,
+    get_hashed_password_async,
     create_access_token,
     create_refresh_token,
-    verify_password,
+    verify_password_async,
     get_current_active_user,
+    invalidate_user,
     is_admin
 )
 
 
 router = APIRouter()
-user_db = UserDB()
 
 
-@router.post('/register', response_description="Create new user", status_code=status.HTTP_201_CREATED, response_model=TokenSchema)
-async def create_user(user: UserBase = Body(...)):
+@router.post('/register', response_description="Create new user", status_code=status.HTTP_201_CREATED, response_model=TokenSchema, dependencies=[Depends(rate_limit("register"))])
+async def create_user(user: UserBase = Body(...), user_db: UserDB = Depends(get_user_db), password_hasher: PasswordHasher = Depends(get_password_hasher)):
     # querying database to check if user already exist
     entity = await user_db.get_user_email(user.email)
     if entity:
@@ -32,10 +38,16 @@ async def create_user(user: UserBase = Body(...)):
         )
 
     # hashing the password
-    user.password = get_hashed_password(user.password)
+    user.password = await get_hashed_password_async(password_hasher, user.password)
 
     # creating new user
-    new_user_id = await user_db.create_user(user.model_dump(by_alias=True, exclude=["id"]))
+    try:
+        new_user_id = await user_db.create_user(user.model_dump(by_alias=True, exclude=["id"]))
+    except DuplicateKeyError: # Registered concurrently, caught by the unique index on email
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User with this email already exist"
+        )
 
     # creating access token
     access_token = create_access_token(user.email)
@@ -48,8 +60,8 @@ async def create_user(user: UserBase = Body(...)):
     }
 
 
-@router.post('/login', response_description="Create access token for user", status_code=status.HTTP_200_OK, response_model=TokenSchema)
-async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+@router.post('/login', response_description="Create access token for user", status_code=status.HTTP_200_OK, response_model=TokenSchema, dependencies=[Depends(rate_limit("login"))])
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), user_db: UserDB = Depends(get_user_db), password_hasher: PasswordHasher = Depends(get_password_hasher)):
     # form_data.username is the email id of the user
     user = await user_db.get_user_email(form_data.username)
     if user is None:
@@ -59,7 +71,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         )
 
     hashed_pass = user['password']
-    if not verify_password(form_data.password, hashed_pass):
+    if not await verify_password_async(password_hasher, form_data.password, hashed_pass):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect email or password"
@@ -79,4 +91,53 @@ async def read_users_me(
     # del current_user["password"]
     # print(current_user)
     
-    return UserBase(**current_user).model_dump(by_alias=True, exclude=["password"])
+    return UserPublic(**current_user).model_dump(by_alias=True)
+
+
+@router.patch("/{user_id}/role", response_description="Change the role of a user", status_code=status.HTTP_200_OK)
+async def update_user_role(
+    request: Request,
+    user_id: str,
+    update: UserRoleUpdate = Body(...),
+    current_user: UserBase = Depends(is_admin),
+    user_db: UserDB = Depends(get_user_db)
+):
+    user = await user_db.update_user_role(user_id, update.role) if ObjectId.is_valid(user_id) else None
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+
+    invalidate_user(request, user["email"])
+    return UserPublic(**user).model_dump(by_alias=True)
+
+
+@router.get("/all", response_description="List users, newest first", status_code=status.HTTP_200_OK)
+async def get_all_users(
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    current_user: UserBase = Depends(is_admin),
+    user_db: UserDB = Depends(get_user_db)
+):
+    after_id = None
+    if cursor:
+        try:
+            after_id = ObjectId(decode_cursor(cursor)["id"])
+        except (ValueError, KeyError, TypeError, InvalidId):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+
+    # One extra document tells whether there is a next page
+    users = await user_db.get_users_page(after_id, limit + 1)
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor({"id": str(users[-1]["_id"])})
+
+    return {
+        "users": [UserPublic(**user).model_dump(by_alias=True) for user in users],
+        "next_cursor": next_cursor,
+    }
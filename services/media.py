@@ -0,0 +1,156 @@
+from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.responses import Response, StreamingResponse
+from starlette import status
+from pydantic import ValidationError
+from bson import ObjectId
+from models.users import UserBase
+from models.upload_image import AssetBase
+from database import AssetDB, get_asset_db
+from services.upload_image import stamp_asset, announce_new_assets
+from utils.multipart import MultipartStream
+from utils.http_cache import etag_matches, parse_range
+from utils.auth import get_current_active_user
+from config import get_settings
+
+
+router = APIRouter()
+
+MEDIA_MAX_METADATA_SIZE = 64 * 1024
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable" # Stored files are never changed
+
+
+# Field of the asset pointing at the uploaded file, based on its content type
+def get_media_field(content_type: str) -> str:
+    for prefix, field in (("image/", "photo"), ("video/", "video"), ("audio/", "audio")):
+        if content_type.startswith(prefix):
+            return field
+    return "document"
+
+
+# Expects a multipart/form-data body with a `file` part and an optional `metadata` part holding the AssetBase JSON
+# The file is piped into GridFS as it is received, then the asset is created with its size, type and URL filled in
+@router.post('/upload', response_description="Upload a media file and create its asset", status_code=status.HTTP_201_CREATED)
+async def upload_asset(request: Request, current_user: UserBase = Depends(get_current_active_user), asset_db: AssetDB = Depends(get_asset_db)):
+    try:
+        multipart = MultipartStream(request.headers.get("content-type", ""))
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error)
+        )
+
+    max_upload_size = get_settings().media_max_upload_size # Bytes accepted per file, 0 for no limit
+    upload = None
+    file_name = None
+    file_type = None
+    file_size = 0
+    metadata = b""
+    part = None
+    try:
+        async for event in multipart.iter_events(request.stream()):
+            if event[0] == "part":
+                _, part, filename, content_type = event
+                if part == "file":
+                    if upload is not None:
+                        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only one file can be uploaded at once")
+                    file_name, file_type = filename, content_type
+                    upload = asset_db.open_media_upload(filename, content_type)
+            elif event[0] == "data":
+                data = event[1]
+                if part == "file":
+                    file_size += len(data)
+                    if max_upload_size and file_size > max_upload_size:
+                        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File is too large")
+                    await upload.write(data)
+                elif part == "metadata":
+                    metadata += data
+                    if len(metadata) > MEDIA_MAX_METADATA_SIZE:
+                        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Metadata is too large")
+            else:
+                part = None
+
+        if upload is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="A file part is required")
+
+        try:
+            asset = AssetBase.model_validate_json(metadata) if metadata else AssetBase()
+        except ValidationError as error:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=error.errors(include_url=False, include_context=False, include_input=False))
+    except BaseException:
+        if upload is not None:
+            await upload.abort() # Removes the chunks written so far
+        raise
+
+    await upload.close()
+
+    file_id = str(upload._id)
+    media_url = str(request.app.url_path_for("get_media", file_id=file_id))
+    setattr(asset, get_media_field(file_type), media_url)
+    asset.src = asset.src or media_url
+    asset.fileName = asset.fileName or file_name
+    asset.fileSize = str(file_size)
+    asset.fileType = file_type
+    stamp_asset(asset, current_user)
+
+    try:
+        new_asset = await asset_db.create_asset(asset.model_dump(by_alias=True, exclude=["id"]))
+    except BaseException:
+        await asset_db.delete_media(upload._id)
+        raise
+    announce_new_assets(request, [{"_id": new_asset, "src": asset.src}])
+
+    return {
+        "id": new_asset,
+        "file_id": file_id,
+        "src": asset.src,
+        "fileSize": asset.fileSize,
+        "fileType": asset.fileType,
+    }
+
+
+# Reads the requested byte range from GridFS chunk by chunk
+async def stream_media(media, start: int, end: int):
+    chunk_size = get_settings().media_chunk_size # Bytes read from GridFS per streamed chunk
+    media.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        data = await media.read(min(chunk_size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+@router.get('/media/{file_id}', name="get_media", response_description="Download a media file, supports Range requests", status_code=status.HTTP_200_OK)
+async def get_media(request: Request, file_id: str, asset_db: AssetDB = Depends(get_asset_db)):
+    media = await asset_db.open_media_download(ObjectId(file_id)) if ObjectId.is_valid(file_id) else None
+    if media is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Media not found"
+        )
+
+    length = media.length
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{file_id}"',
+        "Cache-Control": MEDIA_CACHE_CONTROL,
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        byte_range = parse_range(request.headers.get("range"), length)
+    except ValueError:
+        headers["Content-Range"] = f"bytes */{length}"
+        return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+
+    media_type = (media.metadata or {}).get("contentType", "application/octet-stream")
+    if byte_range is None:
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(stream_media(media, 0, length - 1), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(stream_media(media, start, end), status_code=status.HTTP_206_PARTIAL_CONTENT, media_type=media_type, headers=headers)
@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+from starlette import status
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_description="Metrics in the Prometheus text format", status_code=status.HTTP_200_OK, response_class=PlainTextResponse)
+async def get_metrics(request: Request):
+    return PlainTextResponse(request.app.state.metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,9 +1,26 @@
-from fastapi import APIRouter, Depends, Body
+from fastapi import APIRouter, Depends, Body, Query, Request, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from starlette import status
 from models.users import UserBase
-from models.upload_image import AssetBase, AssetScatter
-from database.upload_image import AssetDB
+from models.upload_image import AssetBase, AssetBatchRequest
+from database import AssetDB, get_asset_db
+from bson import ObjectId
+from bson.errors import InvalidId
+from pydantic import ValidationError
+from typing import Optional
+import asyncio
 import datetime
+import hashlib
+import json
+from config import get_settings
+from utils.scatter_cache import get_available_encodings
+from utils.broadcaster import asset_event
+from utils.http_cache import etag_matches, negotiate_encoding
+from utils.serialization import JSONBytesResponse, asset_document, asset_projection, parse_asset_fields, dumps
+from utils.metrics import record_phase
+from utils.pagination import encode_cursor, decode_cursor
+from utils.geolocation import parse_geolocation, bounding_box_geometry
+from utils.admission import LimitedStreamingResponse
 from utils.auth import (
     get_hashed_password,
     create_access_token,
@@ -12,43 +29,469 @@ from utils.auth import (
     get_current_active_user,
     is_admin
 )
-from utils.scale_image import get_scale_value
 
 
 router = APIRouter()
-asset_db = AssetDB()
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SCATTER_CURSOR_HEADER = "X-Scatter-Cursor"
+ASSET_ETAG_VERSION = "2" # Bump when the serialized shape of an asset changes so that clients drop their copies
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable" # Assets are never updated after creation
+
+# The scatter cache, asset cache and asset feed used below belong to the worker, they are created in the app lifespan
 
-@router.post('/create', response_description="Create new asset", status_code=status.HTTP_201_CREATED)
-async def create_asset(asset: AssetBase = Body(...), current_user: UserBase = Depends(get_current_active_user)):
 
+# Sets the server controlled fields of a new asset
+def stamp_asset(asset: AssetBase, current_user):
     asset.user_id = current_user["_id"]
-    asset.created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    asset.created_at = datetime.datetime.now(datetime.timezone.utc)
+    asset.location = parse_geolocation(asset.geolocation)
+    return asset
+
+
+# Lets the readers know about inserted assets (documents as written, with their `_id`)
+def announce_new_assets(request: Request, documents):
+    request.app.state.scatter_cache.invalidate()
+    if not get_settings().asset_feed_change_stream: # Otherwise the change stream publishes the inserts
+        for document in documents:
+            request.app.state.asset_feed.publish(asset_event(document))
+
+
+@router.post('/create', response_description="Create new asset", status_code=status.HTTP_201_CREATED)
+async def create_asset(request: Request, asset: AssetBase = Body(...), current_user: UserBase = Depends(get_current_active_user), asset_db: AssetDB = Depends(get_asset_db)):
+
+    stamp_asset(asset, current_user)
 
     new_asset = await asset_db.create_asset(asset.model_dump(by_alias=True, exclude=["id"]))
+    announce_new_assets(request, [{"_id": new_asset, "src": asset.src}])
     return new_asset
 
 
+# Yields (index, item, error) for every record of a JSON array or NDJSON body, NDJSON is parsed while it is received
+async def iter_bulk_items(request: Request):
+    if request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+        index = 0
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    yield index, json.loads(line), None
+                except json.JSONDecodeError:
+                    yield index, None, "Invalid JSON"
+                index += 1
+        if buffer.strip():
+            try:
+                yield index, json.loads(buffer), None
+            except json.JSONDecodeError:
+                yield index, None, "Invalid JSON"
+        return
+
+    try:
+        items = json.loads(await request.body())
+    except json.JSONDecodeError:
+        items = None
+    if not isinstance(items, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Body must be a JSON array or NDJSON"
+        )
+    for index, item in enumerate(items):
+        yield index, item, None
+
+
+@router.post('/bulk', response_description="Create many assets", status_code=status.HTTP_200_OK)
+async def create_assets_bulk(request: Request, current_user: UserBase = Depends(get_current_active_user), asset_db: AssetDB = Depends(get_asset_db)):
+    settings = get_settings()
+    results = []
+    inserted = []
+    batch = [] # (index, document) waiting to be written
+
+    async def write_batch():
+        documents = [document for _, document in batch]
+        errors = await asset_db.create_assets(documents)
+        for position, (index, document) in enumerate(batch):
+            if position in errors:
+                results.append({"index": index, "error": errors[position]})
+            else:
+                results.append({"index": index, "id": str(document["_id"])})
+                inserted.append(document)
+        batch.clear()
+
+    async for index, item, error in iter_bulk_items(request):
+        if index >= settings.bulk_max_items:
+            results.append({"index": index, "error": f"Only {settings.bulk_max_items} items are accepted per request"})
+            break
+        if error:
+            results.append({"index": index, "error": error})
+            continue
+
+        try:
+            asset = AssetBase.model_validate(item)
+        except ValidationError as validation_error:
+            results.append({"index": index, "error": validation_error.errors(include_url=False, include_context=False, include_input=False)})
+            continue
+
+        batch.append((index, stamp_asset(asset, current_user).model_dump(by_alias=True, exclude=["id"])))
+        if len(batch) >= settings.bulk_insert_batch_size:
+            await write_batch()
+
+    if batch:
+        await write_batch()
+
+    if inserted:
+        announce_new_assets(request, inserted)
+
+    results.sort(key=lambda result: result["index"])
+    return {
+        "inserted": len(inserted),
+        "failed": len(results) - len(inserted),
+        "results": results,
+    }
+
+
 @router.get("/new", response_description="Get first new asset", status_code=status.HTTP_200_OK, response_model=AssetBase)
-async def get_new_asset():
+async def get_new_asset(asset_db: AssetDB = Depends(get_asset_db)):
     asset = await asset_db.get_newest_asset()
 
     return AssetBase(**asset).model_dump(include=("src"))
 
 
+# Pushes every newly created asset as a Server-Sent Event until the client disconnects
+async def stream_asset_feed(asset_feed, heartbeat: float):
+    async with asset_feed.subscribe() as queue:
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"id: {event['id']}\nevent: asset\ndata: {json.dumps(event)}\n\n"
+
+
+@router.get("/feed", response_description="Stream newly created assets", status_code=status.HTTP_200_OK)
+async def get_asset_feed(request: Request):
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Keep proxies from buffering the stream
+    return StreamingResponse(stream_asset_feed(request.app.state.asset_feed, get_settings().asset_feed_heartbeat), media_type="text/event-stream", headers=headers)
+
+
+# Serializes the scatter assets batch by batch as newline delimited JSON
+async def stream_scatter_assets(asset_db: AssetDB):
+    async for assets in asset_db.iter_scatter_assets(get_settings().scatter_batch_size):
+        yield b"\n".join(dumps(asset) for asset in assets) + b"\n"
+
+
+# Scatter cursors carry the last asset ID the client has and the time it was synced at
+def encode_scatter_cursor(last_id, synced_at: datetime.datetime) -> str:
+    return encode_cursor({"id": last_id, "at": int(synced_at.timestamp() * 1000)})
+
+
+def decode_scatter_cursor(cursor: str):
+    try:
+        values = decode_cursor(cursor)
+        last_id = ObjectId(values["id"]) if values["id"] is not None else None
+        synced_at = datetime.datetime.fromtimestamp(values["at"] / 1000, datetime.timezone.utc)
+    except (ValueError, KeyError, TypeError, OverflowError, OSError, InvalidId):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return last_id, synced_at
+
+
+# Builds the serialized scatter payload, how long it stays valid for the scatter cache and its cursor
+async def build_scatter_snapshot(asset_db: AssetDB):
+    synced_at = datetime.datetime.now(datetime.timezone.utc) # The scales are taken at this moment, the cursor continues from it
+    assets, refresh_in = await asyncio.gather(asset_db.get_scatter_assets(synced_at), asset_db.get_scatter_refresh_in())
+    with record_phase("serialize"):
+        body = dumps(assets)
+    last_id = max((asset["_id"] for asset in assets), default=None) # Hex IDs sort like the ObjectIds
+    return body, refresh_in, encode_scatter_cursor(last_id, synced_at)
+
+
+# Changes since the cursor: `assets` created after it, `updated` scales, `evicted` IDs whose scale reached 0
+# and the next cursor. Clients drop the evicted assets then upsert the others by `_id`.
+# A cursor older than a day gets every asset again with `reset` since all the scales changed by then.
+async def get_scatter_delta(cursor: str, asset_db: AssetDB):
+    last_id, since = decode_scatter_cursor(cursor)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    since = min(since, now) # Issued by a worker whose clock is ahead
+
+    if now - since >= datetime.timedelta(days=1):
+        assets = await asset_db.get_scatter_assets(now)
+        next_id = max((asset["_id"] for asset in assets), default=None)
+        return {"reset": True, "assets": assets, "updated": [], "evicted": [], "cursor": encode_scatter_cursor(next_id, now)}
+
+    # Inserts are sent again for a few seconds before the cursor, their IDs are not committed in order
+    overlap_id = ObjectId.from_datetime(since - datetime.timedelta(seconds=get_settings().scatter_delta_overlap))
+    after_id = overlap_id if last_id is None else min(last_id, overlap_id)
+    if last_id is None: # Nothing was sent yet so nothing can have changed
+        assets, changes = await asset_db.get_scatter_assets_after(after_id, now), []
+    else:
+        assets, changes = await asyncio.gather(asset_db.get_scatter_assets_after(after_id, now), asset_db.get_scatter_changes(last_id, since, now))
+
+    known_ids = [str(last_id)] if last_id is not None else []
+    next_id = max([asset["_id"] for asset in assets] + known_ids, default=None)
+    return {
+        "reset": False,
+        "assets": assets,
+        "updated": [change for change in changes if change["scale"] > 0],
+        "evicted": [change["_id"] for change in changes if change["scale"] <= 0],
+        "cursor": encode_scatter_cursor(next_id, now),
+    }
+
+
 @router.get('/scatter', response_description="Get all assets for scatter page", status_code=status.HTTP_200_OK)
-async def get_assets_scatter():
-    assets = await asset_db.get_scatter_assets()
+async def get_assets_scatter(request: Request, stream: bool = False, since: Optional[str] = None, asset_db: AssetDB = Depends(get_asset_db)):
+    # Only the paths querying MongoDB take a slot, cached snapshots and 304s are answered from memory
+    scatter_limiter = request.app.state.scatter_limiter
+
+    # Delta sync from the cursor of a previous response
+    if since:
+        async with scatter_limiter.slot():
+            delta = await get_scatter_delta(since, asset_db)
+        return JSONBytesResponse(delta, headers={"Cache-Control": "no-store", SCATTER_CURSOR_HEADER: delta["cursor"]})
+
+    # Stream the assets when asked through the query string or the Accept header, the slot is kept until the end of the stream
+    if stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        await scatter_limiter.acquire_or_raise()
+        return LimitedStreamingResponse(stream_scatter_assets(asset_db), scatter_limiter, media_type=NDJSON_MEDIA_TYPE)
+
+    async def load_scatter_snapshot():
+        async with scatter_limiter.slot():
+            return await build_scatter_snapshot(asset_db)
+
+    settings = get_settings()
+    snapshot = await request.app.state.scatter_cache.get(load_scatter_snapshot)
+    encoding = None
+    if len(snapshot.body) >= settings.scatter_compress_min_size:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"), get_available_encodings())
+
+    etag = snapshot.get_etag(encoding)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"} # Clients may keep the payload but have to revalidate it
+    headers[SCATTER_CURSOR_HEADER] = snapshot.cursor # Pass it as `since` to only get the changes next time
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        with record_phase("compress"):
+            level = settings.scatter_brotli_quality if encoding == "br" else settings.scatter_gzip_level
+            body = await snapshot.get_body(encoding, level)
+        return JSONBytesResponse(body, headers=headers)
+    return JSONBytesResponse(snapshot.body, headers=headers)
+
+
+# Raises 400 for fields AssetBase does not have
+def get_requested_fields(fields: str):
+    try:
+        return parse_asset_fields(fields)
+    except ValueError as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error)
+        )
+
+
+# Assets are immutable so the tag only depends on the id and the requested fields
+def get_asset_etag(asset_id: str, fields) -> str:
+    fieldset = hashlib.sha1(",".join(fields).encode()).hexdigest()[:12] if fields is not None else "all"
+    return f'"{ASSET_ETAG_VERSION}-{asset_id}-{fieldset}"'
+
+
+# Resolves the cached assets from memory and the others with one query, `assets` follows the order of asset_ids
+# with null for the missing and invalid ones. Bodies are reused as they are cached so the response is assembled as bytes.
+async def get_assets_batch(request: Request, asset_ids, fields, asset_db: AssetDB):
+    max_ids = get_settings().asset_batch_max_ids
+    if len(asset_ids) > max_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {max_ids} IDs can be fetched at once"
+        )
+
+    asset_cache = request.app.state.asset_cache # (asset_id, fields) -> serialized body
+
+    bodies = {}
+    invalid = []
+    to_fetch = []
+    normalized = {} # Requested spelling -> canonical lowercase id
+    for asset_id in dict.fromkeys(asset_ids): # Without duplicates, order kept
+        if not ObjectId.is_valid(asset_id):
+            invalid.append(asset_id)
+            continue
+        canonical = str(ObjectId(asset_id))
+        normalized[asset_id] = canonical
+        body = asset_cache.get((canonical, fields))
+        if body is None:
+            to_fetch.append(ObjectId(canonical))
+        else:
+            bodies[canonical] = body
+
+    if to_fetch:
+        projection = asset_projection(fields)
+        if projection is not None:
+            projection["_id"] = 1 # Needed to match the documents back to the requested IDs
+        for asset in await asset_db.get_assets(to_fetch, projection):
+            asset_id = str(asset["_id"])
+            bodies[asset_id] = dumps(asset_document(asset, fields=fields))
+            asset_cache.set((asset_id, fields), bodies[asset_id])
+
+    missing = [asset_id for asset_id in normalized if normalized[asset_id] not in bodies]
+    assets = b",".join(bodies.get(normalized.get(asset_id), b"null") for asset_id in asset_ids)
+    return JSONBytesResponse(b'{"assets":[' + assets + b'],"missing":' + dumps(missing) + b',"invalid":' + dumps(invalid) + b"}")
+
 
-    scatter_assets = []
+@router.get('/batch', response_description="Get many assets by ID", status_code=status.HTTP_200_OK)
+async def get_assets_batch_query(request: Request, ids: str, fields: str = None, asset_db: AssetDB = Depends(get_asset_db)):
+    asset_ids = [asset_id.strip() for asset_id in ids.split(",") if asset_id.strip()]
+    return await get_assets_batch(request, asset_ids, get_requested_fields(fields), asset_db)
+
+
+@router.post('/batch', response_description="Get many assets by ID", status_code=status.HTTP_200_OK)
+async def get_assets_batch_body(request: Request, batch: AssetBatchRequest = Body(...), asset_db: AssetDB = Depends(get_asset_db)):
+    fields = ",".join(batch.fields) if batch.fields else None
+    return await get_assets_batch(request, batch.ids, get_requested_fields(fields), asset_db)
+
+
+# `q` is matched against the title, keywords, disaster, place and affected areas (MongoDB $text syntax, "quoted phrases"
+# and -negations work) and ranks the results by relevance, without it the newest assets come first
+@router.get('/search', response_description="Search assets", status_code=status.HTTP_200_OK)
+async def search_assets(
+    q: Optional[str] = None,
+    disaster: Optional[str] = None,
+    place: Optional[str] = None,
+    created_after: Optional[datetime.datetime] = None,
+    created_before: Optional[datetime.datetime] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    asset_db: AssetDB = Depends(get_asset_db)
+):
+    fields = get_requested_fields(fields)
+    text = q.strip() if q and q.strip() else None
+    sort_key = "score" if text else "created_at"
+
+    filters = {}
+    if disaster:
+        filters["disaster"] = disaster
+    if place:
+        filters["place"] = place
+    if created_after or created_before:
+        filters["created_at"] = {}
+        if created_after:
+            filters["created_at"]["$gte"] = created_after
+        if created_before:
+            filters["created_at"]["$lt"] = created_before
+
+    after = None
+    if cursor:
+        try:
+            values = decode_cursor(cursor)
+            value = float(values["score"]) if text else datetime.datetime.fromisoformat(values["created_at"])
+            after = (value, ObjectId(values["id"]))
+        except (ValueError, KeyError, TypeError, InvalidId):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+
+    # One extra document tells whether there is a next page
+    assets = await asset_db.search_assets(filters, text, after, limit + 1, asset_projection(fields))
+    next_cursor = None
+    if len(assets) > limit:
+        assets = assets[:limit]
+        last = assets[-1]
+        value = last[sort_key] if text else last[sort_key].isoformat()
+        next_cursor = encode_cursor({sort_key: value, "id": str(last["_id"])})
+
+    documents = []
     for asset in assets:
-        asset["scale"] = get_scale_value(asset["created_at"])
-        scatter_assets.append(AssetScatter(**asset).model_dump(by_alias=True, include=["src", "scale", "id"]))
+        document = {"_id": str(asset["_id"]), **asset_document(asset, fields=fields)}
+        if text:
+            document["score"] = asset["score"]
+        documents.append(document)
+    return JSONBytesResponse({"assets": documents, "next_cursor": next_cursor})
+
 
-    return scatter_assets
+# `assets` holds one extra document when more than `limit` matched, `truncated` then tells the map to zoom in
+def get_geo_response(assets, fields, limit):
+    documents = []
+    for asset in assets[:limit]:
+        document = {"_id": str(asset["_id"]), **asset_document(asset, fields=fields)}
+        if "distance" in asset:
+            document["distance"] = asset["distance"]
+        documents.append(document)
+    return JSONBytesResponse({"assets": documents, "truncated": len(assets) > limit})
+
+
+# Assets within `radius` meters of the point, nearest first with their `distance` in meters
+@router.get('/near', response_description="Get assets around a point", status_code=status.HTTP_200_OK)
+async def get_assets_near(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(..., gt=0, le=20_037_509), # Up to the antipode
+    fields: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    asset_db: AssetDB = Depends(get_asset_db)
+):
+    fields = get_requested_fields(fields)
+    point = {"type": "Point", "coordinates": [lon, lat]}
+    assets = await asset_db.get_assets_near(point, radius, limit + 1, asset_projection(fields))
+    return get_geo_response(assets, fields, limit)
+
+
+# Assets inside the map viewport, newest first. `west` > `east` for a viewport crossing the antimeridian
+@router.get('/within', response_description="Get assets inside a bounding box", status_code=status.HTTP_200_OK)
+async def get_assets_within(
+    west: float = Query(..., ge=-180, le=180),
+    south: float = Query(..., ge=-90, le=90),
+    east: float = Query(..., ge=-180, le=180),
+    north: float = Query(..., ge=-90, le=90),
+    fields: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    asset_db: AssetDB = Depends(get_asset_db)
+):
+    fields = get_requested_fields(fields)
+    geometry = bounding_box_geometry(west, south, east, north)
+    # No polygon is left when the box goes from 180 to -180, the same meridian
+    if south >= north or west == east or not geometry["coordinates"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Empty bounding box"
+        )
+
+    assets = await asset_db.get_assets_within(geometry, limit + 1, asset_projection(fields))
+    return get_geo_response(assets, fields, limit)
 
 
 @router.get('/{asset_id}', response_description="Get asset by ID", status_code=status.HTTP_200_OK)
-async def get_asset(asset_id: str):
-    asset = await asset_db.get_asset(asset_id)
-    return AssetBase(**asset).model_dump(by_alias=True, exclude=["id"])
+async def get_asset(request: Request, asset_id: str, fields: str = None, asset_db: AssetDB = Depends(get_asset_db)):
+    fields = get_requested_fields(fields)
+    if not ObjectId.is_valid(asset_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Asset not found"
+        )
+
+    # The asset has to exist before a 304 is sent (If-None-Match: * or a guessed tag), the cache usually tells without a query
+    asset_cache = request.app.state.asset_cache
+    body = asset_cache.get((asset_id, fields))
+    if body is None:
+        asset = await asset_db.get_asset(asset_id, asset_projection(fields))
+        if asset is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Asset not found"
+            )
+        body = dumps(asset_document(asset, fields=fields))
+        asset_cache.set((asset_id, fields), body)
+
+    etag = get_asset_etag(asset_id, fields)
+    headers = {"ETag": etag, "Cache-Control": ASSET_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return JSONBytesResponse(body, headers=headers)
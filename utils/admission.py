@@ -0,0 +1,201 @@
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, Request, status
+from starlette.responses import JSONResponse, StreamingResponse
+import asyncio
+import math
+import time
+
+
+
+# Lets at most `max_concurrent` requests run at once, `max_queue` more may wait up to `queue_timeout` seconds for a slot
+# Anything past that is turned away straight away so that the requests already admitted keep their latency
+class ConcurrencyLimiter:
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    # Returns False when the request should be rejected, otherwise release() must be called once it is done
+    async def acquire(self) -> bool:
+        if self.semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                return False
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                return False
+            finally:
+                self.waiting -= 1
+        else:
+            await self.semaphore.acquire()
+
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+
+    @property
+    def retry_after(self) -> str:
+        return str(max(1, math.ceil(self.queue_timeout)))
+
+    # Same as acquire() for route handlers, raises 503 instead of returning False
+    async def acquire_or_raise(self):
+        if not await self.acquire():
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, try again later",
+                headers={"Retry-After": self.retry_after},
+            )
+
+    # Holds a slot for the block
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire_or_raise()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {
+            "limit": self.max_concurrent,
+            "in_flight": self.active,
+            "queue_depth": self.waiting,
+            "queue_limit": self.max_queue,
+            "rejected": self.rejected,
+        }
+
+
+# Parses "METHOD /path=max_concurrent:max_queue, ..." into {(method, path): (max_concurrent, max_queue)}
+def parse_limits(spec: str):
+    limits = {}
+    for rule in spec.split(","):
+        if not rule.strip():
+            continue
+        route, _, limit = rule.partition("=")
+        method, path = route.split()
+        max_concurrent, _, max_queue = limit.partition(":")
+        limits[(method.upper(), path)] = (int(max_concurrent), int(max_queue or 0))
+    return limits
+
+
+def build_limiters(spec: str, queue_timeout: float):
+    return {route: ConcurrencyLimiter(max_concurrent, max_queue, queue_timeout) for route, (max_concurrent, max_queue) in parse_limits(spec).items()}
+
+
+# ASGI middleware applying the per-route limiters found on `app.state.limiters`, keyed by (method, path)
+# The slot is held until the response is fully sent, streamed bodies included
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        limiters = getattr(scope["app"].state, "limiters", {})
+        limiter = limiters.get((scope["method"], scope["path"]))
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limiter.acquire():
+            scope["route_path"] = scope["path"] # The router never runs, the limited paths are the route templates themselves
+            response = JSONResponse(
+                {"detail": "Server is busy, try again later"},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": limiter.retry_after},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+
+# Streaming response releasing a slot taken with `limiter.acquire()` once it is sent, or could not be
+class LimitedStreamingResponse(StreamingResponse):
+    def __init__(self, content, limiter: ConcurrencyLimiter, **kwargs):
+        super().__init__(content, **kwargs)
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.limiter.release()
+
+
+# Token buckets kept in process memory, the least recently used clients are forgotten past `maxsize`
+# Another storage (e.g. shared between the workers) only needs the same `take` coroutine, `__len__` is optional
+# and only used to export the number of tracked clients
+class MemoryBucketStorage:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.buckets = OrderedDict() # key -> (tokens, updated_at)
+
+    # Takes a token from the bucket of `key`, returns 0 on success or the seconds until a token is available
+    async def take(self, key, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.maxsize:
+            self.buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+# Allows `per_minute` requests per key on average with bursts of up to `burst` requests
+class RateLimiter:
+    def __init__(self, per_minute: float, burst: int, storage=None):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.storage = storage if storage is not None else MemoryBucketStorage(10000)
+        self.rejected = 0
+
+    async def take(self, key) -> float:
+        wait = await self.storage.take(key, self.rate, self.burst)
+        if wait:
+            self.rejected += 1
+        return wait
+
+
+# Dependency rate limiting the route per client address, with its own buckets under `name`
+def rate_limit(name: str):
+    async def check_rate_limit(request: Request):
+        rate_limiter = getattr(request.app.state, "rate_limiter", None)
+        if rate_limiter is None:
+            return
+
+        client = request.client.host if request.client else "unknown"
+        wait = await rate_limiter.take((name, client))
+        if wait:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, try again later",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+    return check_rate_limit
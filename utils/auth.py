@@ -1,35 +1,55 @@
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Union, Any, Tuple
-from fastapi import Depends, HTTPException, status
+from functools import lru_cache
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
-import os
-import dotenv
-from database.users import UserDB
+import time
+from config import get_settings
+from database import UserDB, get_user_db
 from models.users import UserBase, TokenData
+from utils.password_hasher import PasswordHasher
+from utils.metrics import record_phase
 
 
 
 
-dotenv.load_dotenv()
-
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user/login")
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30  # 30 minutes
 REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # 7 days
 ALGORITHM = "HS256"
-JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
-JWT_REFRESH_SECRET_KEY = os.getenv("JWT_REFRESH_SECRET_KEY")
+
+
+# Built on first use so that importing the module does not read the settings
+@lru_cache
+def get_password_context() -> CryptContext:
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=get_settings().bcrypt_rounds)
 
 
 def get_hashed_password(password: str) -> str:
-    return password_context.hash(password)
+    return get_password_context().hash(password)
 
 
 def verify_password(password: str, hashed_pass: str) -> bool:
-    return password_context.verify(password, hashed_pass)
+    return get_password_context().verify(password, hashed_pass)
+
+
+# Async variants used by the request handlers, they run on the password hasher pool of the worker instead of the event loop
+
+def get_password_hasher(request: Request) -> PasswordHasher:
+    return request.app.state.password_hasher
+
+
+async def get_hashed_password_async(password_hasher: PasswordHasher, password: str) -> str:
+    with record_phase("password_hash"):
+        return await password_hasher.run(get_hashed_password, password)
+
+
+async def verify_password_async(password_hasher: PasswordHasher, password: str, hashed_pass: str) -> bool:
+    with record_phase("password_hash"):
+        return await password_hasher.run(verify_password, password, hashed_pass)
 
 
 def create_access_token(subject: Union[str, Any], expires_delta: int = None) -> str:
@@ -39,7 +59,7 @@ def create_access_token(subject: Union[str, Any], expires_delta: int = None) ->
         expires_delta = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
     to_encode = {"exp": expires_delta, "sub": str(subject)}
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, get_settings().jwt_secret_key, ALGORITHM)
     return encoded_jwt
 
 
@@ -50,39 +70,54 @@ def create_refresh_token(subject: Union[str, Any], expires_delta: int = None) ->
         expires_delta = datetime.utcnow() + timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)
     
     to_encode = {"exp": expires_delta, "sub": str(subject)}
-    encoded_jwt = jwt.encode(to_encode, JWT_REFRESH_SECRET_KEY, ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, get_settings().jwt_refresh_secret_key, ALGORITHM)
     return encoded_jwt
 
 
-user_db = UserDB()
-
-
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+# The token and user caches of the worker are created in the app lifespan
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), user_db: UserDB = Depends(get_user_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
+    settings = get_settings()
+    token_cache = request.app.state.token_cache # token -> email of a successfully decoded token
+    user_cache = request.app.state.user_cache # email -> user document without the password
+
+    username = token_cache.get(token)
+    if username is None:
         try:
-            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
+            try:
+                payload = jwt.decode(token, settings.jwt_secret_key, algorithms=[ALGORITHM])
+            except JWTError:
+                payload = jwt.decode(token, settings.jwt_refresh_secret_key, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                # print("username is None")
+                raise credentials_exception
+            token_data = TokenData(username=username)
         except JWTError:
-            payload = jwt.decode(token, JWT_REFRESH_SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            # print("username is None")
+            # print("JWTError")
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        # print("JWTError")
-        raise credentials_exception
-    user = await user_db.get_user_email(email=token_data.username)
+        token_cache.set(token, token_data.username, ttl=payload["exp"] - time.time()) # Never outlive the token itself
+
+    user = user_cache.get(username)
     if user is None:
-        # print("user is None")
-        raise credentials_exception
+        user = await user_db.get_user_email(email=username)
+        if user is None:
+            # print("user is None")
+            raise credentials_exception
+        user.pop("password", None)
+        user_cache.set(username, user)
     return user
 
 
+# Must be called after any write that changes the role of a user (including disabling it)
+def invalidate_user(request: Request, email: str):
+    request.app.state.user_cache.pop(email)
+
+
 async def get_current_active_user(
     current_user: UserBase = Depends(get_current_user)
 ):
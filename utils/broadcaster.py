@@ -0,0 +1,47 @@
+from contextlib import asynccontextmanager
+from pymongo.errors import PyMongoError
+import asyncio
+
+
+
+# Shape of the event pushed to the subscribers for a newly created asset
+def asset_event(asset: dict) -> dict:
+    return {"id": str(asset["_id"]), "src": asset.get("src")}
+
+
+# Fans out newly created assets to every connected subscriber of this process
+# Each subscriber gets its own bounded queue, slow subscribers lose their oldest events instead of growing the queue
+class AssetBroadcaster:
+    def __init__(self, queue_size: int = 16):
+        self.queue_size = queue_size
+        self.subscribers = set()
+
+    def publish(self, event: dict):
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    @asynccontextmanager
+    async def subscribe(self):
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self.subscribers.discard(queue)
+
+    # Publishes the inserts seen by a MongoDB change stream so that assets created by any worker reach the subscribers
+    # Change streams need a replica set, the stream is resumed from the last seen event when it fails
+    async def watch(self, collection, retry_delay: float = 5):
+        resume_token = None
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        while True:
+            try:
+                async with collection.watch(pipeline, resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self.publish(asset_event(change["fullDocument"]))
+            except PyMongoError as error:
+                print(f"\nAsset change stream failed: {error}")
+                await asyncio.sleep(retry_delay)
@@ -0,0 +1,47 @@
+import re
+
+
+
+# Two decimal numbers separated by a comma and/or spaces, like "34.052235, -118.243683"
+GEOLOCATION_PATTERN = re.compile(r"^\s*([-+]?\d+(?:\.\d+)?)\s*[,;\s]\s*([-+]?\d+(?:\.\d+)?)\s*$")
+BOX_SLICE_DEGREES = 90 # Polygons sent to MongoDB have to be smaller than a hemisphere
+BOX_EDGE_STEP_DEGREES = 10 # Vertices added along the parallels, MongoDB edges are great circle arcs
+
+
+# Parses the `geolocation` string ("lat, lon") into a GeoJSON Point, None when it is missing or not a valid position
+def parse_geolocation(geolocation):
+    if not geolocation:
+        return None
+
+    match = GEOLOCATION_PATTERN.match(geolocation)
+    if match is None:
+        return None
+
+    latitude, longitude = float(match.group(1)), float(match.group(2))
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return {"type": "Point", "coordinates": [longitude, latitude]} # GeoJSON puts the longitude first
+
+
+def get_parallel(latitude, west, east):
+    if abs(latitude) == 90: # Every longitude is the same point at the poles
+        return [[(west + east) / 2, latitude]]
+    steps = max(1, int((east - west) // BOX_EDGE_STEP_DEGREES) + 1)
+    return [[west + (east - west) * step / steps, latitude] for step in range(steps + 1)]
+
+
+# GeoJSON MultiPolygon covering the longitude/latitude box, west > east means the box crosses the antimeridian
+# The box is cut into slices narrower than BOX_SLICE_DEGREES and the parallels are densified so that
+# the edges stay close to the lines of latitude a map viewport is bounded by
+def bounding_box_geometry(west, south, east, north):
+    intervals = [(west, east)] if west < east else [(west, 180), (-180, east)]
+    polygons = []
+    for start, end in intervals:
+        while start < end:
+            stop = min(end, start + BOX_SLICE_DEGREES)
+            middle = (south + north) / 2 # Keeps the meridian edges apart when the box reaches both poles
+            ring = get_parallel(south, start, stop) + [[stop, middle]] + get_parallel(north, start, stop)[::-1] + [[start, middle]]
+            ring.append(ring[0])
+            polygons.append([ring])
+            start = stop
+    return {"type": "MultiPolygon", "coordinates": polygons}
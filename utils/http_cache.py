@@ -0,0 +1,71 @@
+# Helpers for conditional HTTP requests
+
+
+
+# Checks an If-None-Match header against the ETag of the current representation (weak comparison as required by RFC 9110)
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    etag = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        if candidate.strip().removeprefix("W/") == etag:
+            return True
+    return False
+
+
+# Parses a single `bytes=` range into inclusive (start, end) offsets, None means the whole body is sent
+# (no header, a malformed one or several ranges). Raises ValueError when the range can not be satisfied.
+def parse_range(range_header: str, length: int):
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    spec = range_header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+
+    start, _, end = spec.partition("-")
+    try:
+        start = int(start) if start.strip() else None
+        end = int(end) if end.strip() else None
+    except ValueError:
+        return None
+
+    if start is None: # Suffix range, the last `end` bytes
+        if not end or length == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(length - end, 0), length - 1
+
+    if end is not None and end < start:
+        return None
+    if start >= length:
+        raise ValueError("Unsatisfiable range")
+    return start, length - 1 if end is None else min(end, length - 1)
+
+
+# Picks the preferred content coding among `available` (in server preference order) from an Accept-Encoding header
+# Returns None when the body should be sent as it is
+def negotiate_encoding(accept_encoding: str, available) -> str:
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    best = None
+    best_quality = 0.0
+    for coding in available:
+        quality = qualities.get(coding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
@@ -0,0 +1,203 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pymongo import monitoring
+import threading
+import time
+
+
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Time spent per phase by the current request, filled by the Mongo listener and record_phase
+# Motor runs the driver calls on its executor with a copy of the context, so the same dict is reached from there
+request_phases: ContextVar = ContextVar("request_phases", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for index, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[index] += 1
+                break
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    values = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+    return "{" + values + "}"
+
+
+# Store of the metrics of one app, rendered in the Prometheus text format
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock() # The Mongo listener reports from the driver threads
+        self.requests = {} # (method, route, status) -> count
+        self.request_latency = {} # (method, route) -> Histogram
+        self.mongo_latency = {} # (collection, command) -> Histogram
+        self.mongo_documents = {} # (collection, command) -> count
+        self.mongo_failures = {} # (collection, command) -> count
+        self.gauges = [] # Functions returning [(name, labels, value)] when rendered
+        self.counters = [] # Same for values that only ever increase, exported with a `_total` suffix
+
+    def observe_request(self, method, route, status, seconds):
+        with self.lock:
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.request_latency.setdefault((method, route), Histogram()).observe(seconds)
+
+    def observe_mongo(self, collection, command, seconds, documents, failed=False):
+        with self.lock:
+            key = (collection, command)
+            self.mongo_latency.setdefault(key, Histogram()).observe(seconds)
+            self.mongo_documents[key] = self.mongo_documents.get(key, 0) + documents
+            if failed:
+                self.mongo_failures[key] = self.mongo_failures.get(key, 0) + 1
+
+    def add_gauges(self, collect):
+        self.gauges.append(collect)
+
+    def add_counters(self, collect):
+        self.counters.append(collect)
+
+    def render(self) -> str:
+        lines = []
+
+        def add_histogram(name, help_text, histograms, label_names):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in histograms.items():
+                labels = dict(zip(label_names, key))
+                cumulative = 0
+                for bucket, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels({**labels, 'le': bucket})} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        def add_counter(name, help_text, counters, label_names):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in counters.items():
+                lines.append(f"{name}{format_labels(dict(zip(label_names, key)))} {value}")
+
+        with self.lock:
+            add_counter("http_requests_total", "HTTP requests by route and status", self.requests, ("method", "route", "status"))
+            add_histogram("http_request_duration_seconds", "HTTP request latency by route", self.request_latency, ("method", "route"))
+            add_histogram("mongodb_command_duration_seconds", "MongoDB command latency", self.mongo_latency, ("collection", "command"))
+            add_counter("mongodb_command_documents_total", "Documents returned or written by MongoDB commands", self.mongo_documents, ("collection", "command"))
+            add_counter("mongodb_command_failures_total", "Failed MongoDB commands", self.mongo_failures, ("collection", "command"))
+
+        seen = set()
+        for kind, suffix, collectors in (("gauge", "", self.gauges), ("counter", "_total", self.counters)):
+            for collect in collectors:
+                for name, labels, value in collect():
+                    name += suffix
+                    if name not in seen:
+                        lines.append(f"# TYPE {name} {kind}")
+                        seen.add(name)
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def add_phase(name: str, seconds: float):
+    phases = request_phases.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+# Adds the time spent in the block to the phase breakdown of the current request
+@contextmanager
+def record_phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase(name, time.perf_counter() - start)
+
+
+# Records the duration and the number of documents of every command sent by the Motor client it is attached to
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self.collections = {}
+
+    def get_collection(self, event):
+        if event.command_name == "getMore":
+            return event.command.get("collection")
+        collection = event.command.get(event.command_name)
+        return collection if isinstance(collection, str) else None
+
+    def started(self, event):
+        self.collections[(event.connection_id, event.request_id)] = self.get_collection(event) or event.database_name
+
+    def count_documents(self, reply):
+        cursor = reply.get("cursor")
+        if isinstance(cursor, dict):
+            return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+        value = reply.get("n")
+        return value if isinstance(value, int) else 0
+
+    def succeeded(self, event):
+        collection = self.collections.pop((event.connection_id, event.request_id), event.database_name)
+        seconds = event.duration_micros / 1_000_000
+        self.registry.observe_mongo(collection, event.command_name, seconds, self.count_documents(event.reply))
+        add_phase("mongo", seconds)
+
+    def failed(self, event):
+        collection = self.collections.pop((event.connection_id, event.request_id), event.database_name)
+        seconds = event.duration_micros / 1_000_000
+        self.registry.observe_mongo(collection, event.command_name, seconds, 0, failed=True)
+        add_phase("mongo", seconds)
+
+
+# ASGI middleware counting the requests and their latency per route template, with an optional slow request log
+class MetricsMiddleware:
+    def __init__(self, app, registry: MetricsRegistry, slow_request_seconds: float = 0):
+        self.app = app
+        self.registry = registry
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        phases = {}
+        token = request_phases.set(phases)
+        response_status = 500
+
+        async def send_with_status(message):
+            nonlocal response_status
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+                phases.setdefault("first_byte", time.perf_counter() - start)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_phases.reset(token)
+            elapsed = time.perf_counter() - start
+            route = scope.get("route") # Set by the router, keeps the label count bounded (/asset/{asset_id})
+            route_path = getattr(route, "path", None) or scope.get("route_path", "unmatched") # `route_path` is set by middlewares answering before the router
+            self.registry.observe_request(scope["method"], route_path, response_status, elapsed)
+
+            if self.slow_request_seconds and elapsed >= self.slow_request_seconds:
+                breakdown = " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in phases.items())
+                print(f"\nSlow request {scope['method']} {scope['path']} ({route_path}) {response_status} took {elapsed * 1000:.1f}ms {breakdown}")
@@ -0,0 +1,69 @@
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError: # python-multipart before 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+
+# Incremental multipart/form-data parser, nothing is buffered beyond the chunk being parsed
+# iter_events yields ("part", name, filename, content_type), ("data", bytes) and ("end",) as the body is received
+class MultipartStream:
+    def __init__(self, content_type_header: str):
+        content_type, params = parse_options_header(content_type_header)
+        boundary = params.get(b"boundary")
+        if content_type != b"multipart/form-data" or not boundary:
+            raise ValueError("Expected a multipart/form-data body")
+
+        self.events = []
+        self.headers = {}
+        self.header_field = b""
+        self.header_value = b""
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        })
+
+    def on_part_begin(self):
+        self.headers = {}
+
+    def on_header_field(self, data, start, end):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self):
+        _, disposition = parse_options_header(self.headers.get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode()
+        filename = disposition.get(b"filename")
+        content_type = self.headers.get(b"content-type", b"application/octet-stream").decode()
+        self.events.append(("part", name, filename.decode() if filename else None, content_type))
+
+    def on_part_data(self, data, start, end):
+        self.events.append(("data", bytes(data[start:end])))
+
+    def on_part_end(self):
+        self.events.append(("end",))
+
+    async def iter_events(self, stream):
+        async for chunk in stream:
+            if chunk:
+                self.parser.write(chunk)
+            events, self.events = self.events, []
+            for event in events:
+                yield event
+
+        self.parser.finalize()
+        for event in self.events:
+            yield event
+        self.events = []
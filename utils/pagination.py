@@ -0,0 +1,24 @@
+import base64
+import binascii
+import json
+
+
+
+# Cursors are opaque to the clients, they carry the sort values of the last returned document
+
+def encode_cursor(values: dict) -> str:
+    data = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+# Raises ValueError when the token was not produced by encode_cursor
+def decode_cursor(token: str) -> dict:
+    try:
+        data = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(data)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+
+    if not isinstance(values, dict):
+        raise ValueError("Invalid cursor")
+    return values
@@ -2,20 +2,38 @@ import datetime
 
 
 
-# This function is used to get the scale value based on the creation date of the asset
-# Ranging from 0 to 1, the scale value is used to determine how old the asset is. Every day it is decreased by 0.1
-# created_at will be like 2024-08-01 07:42:53
-def get_scale_value(created_at: str) -> float:
-    current_date = datetime.datetime.now()
-    created_date = datetime.datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
+SCALE_STEP = 0.1 # Scale lost by an asset every day
+FADE_DAYS = 10 # Number of days after which the scale of an asset reaches 0
+DAY_MS = 24 * 60 * 60 * 1000
 
-    days_difference = (current_date - created_date).days
-    scale_value = max(1 - (days_difference * 0.1), 0)
-    return scale_value
 
+# Assets created before this moment have a scale of 0 and can be skipped by the queries
+def get_fade_cutoff(now: datetime.datetime = None) -> datetime.datetime:
+    return (now or datetime.datetime.now(datetime.timezone.utc)) - datetime.timedelta(days=FADE_DAYS)
 
 
+# `now` defaults to the clock of the MongoDB server, a datetime pins the ages to that moment
+def age_ms_expression(created_at_field: str = "$created_at", now="$$NOW") -> dict:
+    return {"$dateDiff": {"startDate": created_at_field, "endDate": now, "unit": "millisecond"}}
 
 
+# Aggregation expression computing the scale inside MongoDB, from 1 for new assets down to 0 by SCALE_STEP every day (requires MongoDB 5.0+ for $dateDiff)
+# The age is taken in milliseconds so that whole days are counted like timedelta.days and not by calendar boundaries
+def scale_expression(created_at_field: str = "$created_at", now="$$NOW") -> dict:
+    days_difference = {"$floor": {"$divide": [age_ms_expression(created_at_field, now), DAY_MS]}}
+    return {"$max": [{"$subtract": [1, {"$multiply": [days_difference, SCALE_STEP]}]}, 0]}
 
 
+# Query matching the assets whose scale dropped by a step between `since` and `until` (aware UTC datetimes, less than a day apart)
+# An asset loses its k-th step once it is k days old, so it changed when it was created in (since - k days, until - k days]
+def scale_changes_filter(since: datetime.datetime, until: datetime.datetime) -> dict:
+    ranges = []
+    for days in range(1, FADE_DAYS + 1):
+        age = datetime.timedelta(days=days)
+        ranges.append({"created_at": {"$gt": since - age, "$lte": until - age}})
+    return {"$or": ranges}
+
+
+# Aggregation expression giving the milliseconds left until the scale of an asset drops to its next step
+def scale_change_expression(created_at_field: str = "$created_at") -> dict:
+    return {"$subtract": [DAY_MS, {"$mod": [age_ms_expression(created_at_field), DAY_MS]}]}
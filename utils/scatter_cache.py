@@ -0,0 +1,86 @@
+import asyncio
+import gzip
+import hashlib
+import time
+
+try:
+    import brotli
+except ImportError: # Optional, only gzip is offered without it
+    brotli = None
+
+
+
+# A serialized scatter payload together with the strong ETag derived from its bytes and the delta sync cursor
+# Compressed variants are produced on first demand, once per snapshot, and shared by every request
+class ScatterSnapshot:
+    def __init__(self, body: bytes, version: int, expires_at: float, cursor: str = None):
+        self.body = body
+        self.cursor = cursor
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.version = version
+        self.expires_at = expires_at
+        self.encoded = {} # encoding -> task producing the compressed body
+
+    # Every representation needs its own strong ETag
+    def get_etag(self, encoding: str = None) -> str:
+        if encoding is None:
+            return self.etag
+        return self.etag[:-1] + "-" + encoding + '"'
+
+    async def get_body(self, encoding: str = None, level: int = None) -> bytes:
+        if encoding is None:
+            return self.body
+        if encoding not in self.encoded:
+            # Compression runs off the event loop, concurrent requests wait for the same task
+            self.encoded[encoding] = asyncio.ensure_future(asyncio.to_thread(compress, self.body, encoding, level))
+        return await self.encoded[encoding]
+
+
+def get_available_encodings():
+    return ("br", "gzip") if brotli else ("gzip",)
+
+
+def compress(body: bytes, encoding: str, level: int = None) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if level is None else level)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=9 if level is None else level, mtime=0) # mtime=0 keeps the bytes stable
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+
+# In-process cache holding the latest scatter snapshot
+# The snapshot is dropped when an asset is written (invalidate) or when it expires, which happens
+# at the latest after `ttl` seconds and earlier when the scale of one of the assets is about to change
+class ScatterCache:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.version = 0
+        self.snapshot = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.version += 1
+
+    def get_fresh_snapshot(self):
+        snapshot = self.snapshot
+        if snapshot and snapshot.version == self.version and time.monotonic() < snapshot.expires_at:
+            return snapshot
+        return None
+
+    # loader returns the serialized body, the number of seconds it stays valid (None when unknown) and its cursor
+    async def get(self, loader) -> ScatterSnapshot:
+        snapshot = self.get_fresh_snapshot()
+        if snapshot:
+            return snapshot
+
+        # Only one request rebuilds the snapshot, the others wait and reuse it
+        async with self._lock:
+            snapshot = self.get_fresh_snapshot()
+            if snapshot:
+                return snapshot
+
+            version = self.version # Captured before loading so a write during the load marks the result stale
+            body, valid_for, cursor = await loader()
+            ttl = self.ttl if valid_for is None else min(self.ttl, valid_for)
+            self.snapshot = ScatterSnapshot(body, version, time.monotonic() + ttl, cursor)
+            return self.snapshot
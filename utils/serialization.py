@@ -0,0 +1,66 @@
+from fastapi.responses import Response
+from bson import ObjectId
+from models.upload_image import AssetBase, CREATED_AT_FORMAT
+import datetime
+import orjson
+
+
+
+# Keys of an asset as they are sent to the clients (by alias), in the order of AssetBase
+ASSET_FIELDS = [field.alias or name for name, field in AssetBase.model_fields.items()]
+ASSET_FIELD_NAMES = {**{key: key for key in ASSET_FIELDS}, "id": "_id"} # Accepted spellings in ?fields=
+
+
+# Handles the BSON types orjson does not know, dates use the same format as the AssetBase model
+def default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return value.strftime(CREATED_AT_FORMAT)
+    raise TypeError
+
+
+def dumps(value) -> bytes:
+    return orjson.dumps(value, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+# Fast path for documents whose shape is already fixed by the MongoDB projection, no model is built for them
+# Gives the same keys as AssetBase(**asset).model_dump(by_alias=True, exclude=exclude), or only `fields` when given
+def asset_document(asset: dict, exclude=("_id",), fields=None) -> dict:
+    if fields is not None:
+        return {key: asset.get(key) for key in fields}
+    return {key: asset.get(key) for key in ASSET_FIELDS if key not in exclude}
+
+
+# Parses a comma separated sparse fieldset into AssetBase keys (in model order), None means every field
+# Raises ValueError naming the fields AssetBase does not have
+def parse_asset_fields(fields: str):
+    if not fields:
+        return None
+
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in ASSET_FIELD_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    keys = {ASSET_FIELD_NAMES[field] for field in requested}
+    return tuple(key for key in ASSET_FIELDS if key in keys)
+
+
+# MongoDB projection returning only the given keys
+def asset_projection(fields):
+    if fields is None:
+        return None
+    projection = {key: 1 for key in fields}
+    projection.setdefault("_id", 0)
+    return projection
+
+
+# Response sending already serialized bytes as they are, anything else is encoded with orjson
+class JSONBytesResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)